@@ -1,7 +1,15 @@
-import os, csv, sys, re, json, math
-from itertools import accumulate, chain
+import os, csv, re, json, hashlib, time, shutil
+from itertools import chain
+from collections import deque
 from datetime import datetime
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from http_session import get_session
+from json_decode import loads, decode_docs
+from records import record_type, clean_table
+from search_index import SearchIndex, FTSSearchIndex
+from arrow_export import write_records_columnar
+from snapshot import Snapshot, write_snapshot
+from metrics import get_metrics
 
 """ 
 Classes used to query IR and export output:
@@ -40,12 +48,38 @@ class RepositoryQuery():
                 "Cooperative Science Centers": "24914"
             }
 
-    def __init__(self, fields):
+    def __init__(self, fields, max_workers=4, session=None, metrics=None):
         self.api_url =  "https://repository.library.noaa.gov/fedora/export/view/collection/"
         self.fields = fields
         self.pid = ''
         self.collection_data = []   
         self.date_params = {}
+        # max number of page requests in flight at once
+        self.max_workers = max_workers
+        # pooled session shared across all requests
+        self.session = session or get_session()
+        # AdaptivePaginator, fixed size pages are used if None
+        self.paginator = None
+        # directory completed pages are saved to so interrupted
+        # harvests can resume, no checkpoints if None. Only used by
+        # get_single_collection_json and get_all_ir, not by
+        # iter_collection_json or the paginator
+        self.checkpoint_dir = None
+        # fields kept when decoding pages, all fields if None
+        self.decode_fields = None
+        # request only fields via fl param. Endpoints that ignore
+        # fl still work, fields are also projected client side. Off
+        # by default, collection_data then holds whole documents
+        self.field_projection = False
+        # SearchIndex over collection_data, built on first search
+        self.search_index = None
+        # (row total, probe docs, query params, doc fields) from
+        # get_row_totals, keyed on pid and date params. Each is used
+        # once by the next harvest of its pid
+        self.row_totals = {}
+        # metrics.Metrics stage timings are recorded in. Shared
+        # Metrics, disabled unless configured, used if None
+        self.metrics = metrics or get_metrics()
 
     
     def date_filter(self, from_d, until_d=today):
@@ -78,6 +112,61 @@ class RepositoryQuery():
 
         return self.date_params 
 
+
+    def watermark_filter(self, watermark):
+        """
+        Update date_params to only request items created since
+        watermark. Used by incremental harvests.
+
+        Parameters:
+            watermark: 'YYYY-MM-DDTHH:MM:SSZ' string, i.e. the latest
+                fgs.createdDate seen during a previous harvest.
+
+        Returns:
+            updated date_params.
+        """
+
+        self.date_params = {
+            'from': watermark,
+            'until': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+            }
+
+        return self.date_params
+
+
+
+    def query_params(self, extra_fields=()):
+        """
+        Query params sent with each page request. Date window
+        and, if field_projection is set, fields as an fl param.
+
+        Parameters:
+            extra_fields: fields needed beyond fields, i.e. date
+                field used for watermarks.
+
+        Returns:
+            dict of query params.
+        """
+
+        params = dict(self.date_params)
+        if self.field_projection:
+            fields = list(dict.fromkeys(list(self.fields) + list(extra_fields)))
+            params['fl'] = ','.join(fields)
+        return params
+
+
+    def doc_fields(self, extra_fields=()):
+        """
+        Fields kept when decoding pages, including extra_fields.
+
+        Returns:
+            list of fields, None if all fields are kept.
+        """
+
+        if self.decode_fields is None:
+            return None
+        return list(dict.fromkeys(list(self.decode_fields) + list(extra_fields)))
+
         
     def get_single_collection_json(self,pid):
         """
@@ -95,14 +184,24 @@ class RepositoryQuery():
             Response header and Documents from an IR collection in JSON.
         """
         
+        if self.paginator is not None:
+            self.collection_data = list(self.iter_collection_json(pid))
+            return
+
         self.pid = str(pid)
 
         full_url = self.api_url + check_pid(self.pid_dict, self.pid)
-        row_total = get_row_total(self.api_url, self.pid) # function
-        api_url_info = iterate_rows(self.api_url, self.pid, row_total)
+        row_total, first_page = self.probe(self.pid)
+        # docs returned by the probe are page 0
+        api_url_info = iterate_rows(self.api_url, self.pid, row_total,
+            start=len(first_page))
 
         # call concat_json function
-        self.collection_data = concat_json(api_url_info, full_url, self.date_params)
+        self.metrics.progress(f'harvest_{self.pid}', 0, row_total)
+        self.collection_data = first_page + \
+            self.concat_json(api_url_info, full_url)
+        self.metrics.progress(f'harvest_{self.pid}',
+            len(self.collection_data))
 
 
     def get_all_collections_json(self):
@@ -121,27 +220,224 @@ class RepositoryQuery():
         """
 
         all_ir_json = 'noaa'
+        if self.paginator is not None:
+            self.collection_data = list(self.iter_collection_json(all_ir_json))
+            return
+
         full_url = f'{self.api_url}{all_ir_json}'
-        row_total = get_row_total(self.api_url, all_ir_json) # function
-        api_url_info = iterate_rows(self.api_url, all_ir_json, row_total)
+        row_total, first_page = self.probe(all_ir_json)
+        # docs returned by the probe are page 0
+        api_url_info = iterate_rows(self.api_url, all_ir_json, row_total,
+            start=len(first_page))
 
         # call concat_json function
-        self.collection_data = concat_json(api_url_info, full_url, self.date_params)
+        self.metrics.progress(f'harvest_{all_ir_json}', 0, row_total)
+        self.collection_data = first_page + \
+            self.concat_json(api_url_info, full_url)
+        self.metrics.progress(f'harvest_{all_ir_json}',
+            len(self.collection_data))
+
+
+    def probe(self, pid, extra_fields=()):
+        """
+        Row total of a collection, using a count probe that
+        requests zero rows within the current date window. A total
+        from get_row_totals is used instead if there is one, along
+        with its probe docs if they were requested with the same
+        fields.
+
+        Parameters:
+            pid: collection pid
+            extra_fields: document fields needed beyond fields
+
+        Returns:
+            tuple of (row total, page 0 docs). Docs are only returned
+            if the endpoint ignored rows=0, otherwise the list is empty.
+        """
+
+        params = self.query_params(extra_fields)
+        fields = self.doc_fields(extra_fields)
+
+        probed = self.row_totals.pop(self.row_total_key(pid), None)
+        if probed is not None:
+            total, docs, probe_params, probe_fields = probed
+            if probe_params != params or probe_fields != fields:
+                docs = []
+            return total, docs
+
+        with self.metrics.stage('count'):
+            return probe_collection(self.api_url, pid, params,
+                self.session, self.metrics, fields)
+
+
+    def get_row_totals(self, pids=None):
+        """
+        Batched count probe. Row totals are requested concurrently,
+        zero rows each, and kept with any probe docs so the next
+        harvest of each collection doesn't probe it again. Totals
+        not yet used can be dropped with row_totals.clear().
+
+        Parameters:
+            pids: collection pids. Defaults to every pid_dict collection.
+
+        Returns:
+            dict of pid: row total.
+        """
+
+        pids = [str(pid) for pid in (pids or self.pid_dict.values())]
+        params = self.query_params()
+        fields = self.doc_fields()
+        with self.metrics.stage('count'):
+            probes = get_row_totals(self.api_url, pids, params,
+                self.session, self.metrics, self.max_workers, fields)
+
+        for pid, (total, docs) in probes.items():
+            self.row_totals[self.row_total_key(pid)] = (total, docs,
+                params, fields)
+        return {pid: total for pid, (total, docs) in probes.items()}
+
+
+    def row_total_key(self, pid):
+        """Key of row_totals, a total only applies to one date window."""
+        return (str(pid), tuple(sorted(self.date_params.items())))
+
+
+    def concat_json(self, api_url_info, full_url):
+        """
+        Calls concat_json function with instance settings. If
+        checkpoint_dir is set, saved pages are removed once the
+        harvest completes.
+
+        Returns:
+            list of IR records.
+        """
+
+        params = self.query_params()
+
+        if self.checkpoint_dir is None:
+            return concat_json(api_url_info, full_url,
+                params, self.max_workers, self.session,
+                fields=self.decode_fields, metrics=self.metrics)
+
+        checkpoint_dir = harvest_checkpoint_dir(self.checkpoint_dir,
+            full_url, params, self.decode_fields)
+        docs = concat_json(api_url_info, full_url, params,
+            self.max_workers, self.session, checkpoint_dir,
+            self.decode_fields, self.metrics)
+        shutil.rmtree(checkpoint_dir)
+        return docs
+
+
+    def iter_collection_json(self, pid='noaa', extra_fields=()):
+        """
+        Streams IR collection documents via REST API.
+
+        Unlike get_single_collection_json, documents are yielded page
+        by page as they arrive and are not stored in collection_data,
+        so memory is bounded by the pages in flight. Pages aren't
+        checkpointed, checkpoint_dir is ignored.
+
+        Parameters:
+            pid: collection pid. Default 'noaa' streams entire IR.
+            extra_fields: document fields needed beyond fields
+
+        Returns:
+            generator of documents from an IR collection.
+        """
+
+        # local pid rather than self.pid, collections may be
+        # streamed from several threads on one RepositoryQuery
+        pid = str(pid)
+
+        full_url = self.api_url + check_pid(self.pid_dict, pid)
+        row_total, first_page = self.probe(pid, extra_fields)
+
+        params = self.query_params(extra_fields)
+        fields = self.doc_fields(extra_fields)
+
+        if first_page and len(first_page) >= row_total:
+            docs = iter(first_page)
+        elif self.paginator is not None:
+            # paginator pages from the start, probe docs aren't reused
+            docs = self.paginator.iter_docs(full_url, row_total,
+                params, self.session, fields, self.metrics)
+        else:
+            # docs returned by the probe are page 0
+            api_url_info = iterate_rows(self.api_url, pid, row_total,
+                start=len(first_page))
+            docs = chain(first_page, iter_json(api_url_info, full_url,
+                params, self.max_workers, self.session, fields, self.metrics))
+
+        return self.metrics.track(f'harvest_{pid}', docs, row_total)
+
+
+    def iter_fields(self, docs):
+        """
+        Lazily filters documents based on fields list.
+
+        Parameters:
+            docs: iterable of documents, i.e. iter_collection_json
+
+        Returns:
+            generator of filtered records.Record.
+        """
+
+        record = record_type(self.fields)
+        for doc in docs:
+            yield record(field_values(doc, self.fields))
         
 
+    def save_snapshot(self, file_path, pid='noaa'):
+        """
+        Harvest a collection straight into a memory-mapped
+        snapshot file. See snapshot.py.
+
+        Parameters:
+            file_path: snapshot file path
+            pid: collection pid. Default 'noaa' is entire IR.
+
+        Returns:
+            number of records written.
+        """
+
+        return write_snapshot(file_path,
+            self.iter_collection_json(pid), self.fields)
+
+
+    def load_snapshot(self, file_path):
+        """
+        Open snapshot as collection data without a harvest.
+        Records are read lazily from the memory map.
+
+        Parameters:
+            file_path: snapshot file path
+
+        Returns:
+            Snapshot, also stored in collection_data.
+        """
+
+        self.collection_data = Snapshot(file_path)
+        return self.collection_data
+
+
     def filter_on_fields(self):
         """
         Filters JSON based on fields list passed into function.        
 
         Returns:
-            Documents of from an IR collection in JSON
+            Updates collection_data with a records.Record per
+            document, not a dict. Use Record.as_dict for
+            pd.DataFrame or json.dumps.
         """
 
         filtered_data = []
 
-        for doc in self.collection_data:
-            filtered_data.append(
-                field_iterator(doc, self.fields))
+        # compact records, field names are shared by all records
+        record = record_type(self.fields)
+        with self.metrics.stage('filter'):
+            for doc in self.collection_data:
+                filtered_data.append(
+                    record(field_values(doc, self.fields)))
              
         self.collection_data = filtered_data
 
@@ -159,26 +455,20 @@ class RepositoryQuery():
 
         Returns: 
             Updates RepositoryQuery collection_data attribute
-            with new values.
+            with new values, as records.Record of PID and field.
         """
 
+        record = record_type(['PID', field])
         data = []
 
         for item in self.collection_data:
-            if ';' in item[field]:
-                for multi_item in item[field].split(delimiter):
-                    data.append({
-                        'PID': item['PID'],
-                        field : multi_item
-                        })
+            pid, value = item['PID'], item[field]
+            if ';' in value:
+                values = value.split(delimiter)
             else:
-                data.append({
-                        'PID': item['PID'],
-                        field: item[field]
-                        })
-
-        # remove entries where fields equal ''    
-        data = [x for x in data if x[field] != '']
+                values = (value,)
+            # remove entries where fields equal ''
+            data.extend([record((pid, v)) for v in values if v != ''])
 
         self.collection_data = data
 
@@ -193,27 +483,191 @@ class RepositoryQuery():
         Simple search is performed on selected field. 
         Search is converted to lower lower as is field to be searched on.
 
+        Searches use a SearchIndex built once for the current
+        collection data and reused until collection data changes.
+
         Parameters:
             field: field to be searched on
             search_value: value that searches against field
 
         Returns:
-            list of dicts.
+            list of records.
         """
         
         if len(self.collection_data) == 0:
             raise Exception('No Collection data present. Make sure to pull data (single collection or entire dataset)')
 
-        result_list = []
+        return self.build_search_index().contains(field, search_value)
+
+
+    def search(self, query, fields=None, prefix=True):
+        """
+        Token search across one or more fields. Every word in
+        query must match in at least one of fields.
+
+        Parameters:
+            query: search string
+            fields: fields to search. Defaults to instance fields.
+            prefix: words also match longer words starting with them
+
+        Returns:
+            list of records.
+        """
+
+        if len(self.collection_data) == 0:
+            raise Exception('No Collection data present. Make sure to pull data (single collection or entire dataset)')
+
+        # use existing index of either kind if still current
+        index = self.search_index
+        if index is None or index.records is not self.collection_data:
+            index = self.build_search_index()
+
+        if isinstance(index, FTSSearchIndex):
+            return index.search(query, fields, prefix)
+        return index.search(query, fields or self.fields, prefix)
+
+
+    def build_search_index(self, fields=(), fts=False):
+        """
+        Build search index over collection data, unless one
+        already exists for the current collection data.
+
+        Parameters:
+            fields: fields to index up front. Other fields are
+                indexed on first search.
+            fts: use SQLite FTS5 index, which supports search but
+                not search_field substring lookups.
+
+        Returns:
+            SearchIndex or FTSSearchIndex.
+        """
+
+        index = self.search_index
+        if index is None or index.records is not self.collection_data or \
+            isinstance(index, FTSSearchIndex) != fts:
+            if fts:
+                index = FTSSearchIndex(self.collection_data,
+                    fields or self.fields)
+            else:
+                index = SearchIndex(self.collection_data, fields)
+            self.search_index = index
+        return index
+
+
+class AdaptivePaginator():
+    """
+    Pages through a collection, tuning rows per request from
+    observed response latency and payload size.
+
+    Tuned row_num carries over between collections, so a paginator
+    shared by a RepositoryQuery keeps what it has learned.
+    """
+
+    def __init__(self, row_num=5000, min_rows=500, max_rows=20000,
+        target_seconds=2.0, target_bytes=20 * 1024 * 1024, cursor=False):
+        self.row_num = row_num
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        # use Solr cursorMark paging, falls back to start offsets
+        # if the endpoint doesn't return a nextCursorMark
+        self.cursor = cursor
+        # (rows, seconds, bytes) for each page requested
+        self.history = []
+
+
+    def tune(self, rows, seconds, size):
+        """
+        Update row_num from the last page's rows, latency and size.
+
+        row_num moves toward whichever of target_seconds or
+        target_bytes is hit first, by at most 2x per page.
+        """
+        if rows == 0 or seconds <= 0:
+            return self.row_num
+
+        by_latency = rows * self.target_seconds / seconds
+        by_size = rows * self.target_bytes / max(size, 1)
+        row_num = min(by_latency, by_size)
+
+        # limit change per page to avoid oscillating
+        row_num = max(self.row_num / 2, min(self.row_num * 2, row_num))
+        self.row_num = int(max(self.min_rows, min(self.max_rows, row_num)))
+        return self.row_num
+
+
+    def throughput(self):
+        """
+        Returns:
+            dict of rows per request: docs per second observed.
+        """
+        stats = {}
+        for rows, seconds, size in self.history:
+            docs, total_seconds = stats.get(rows, (0, 0))
+            stats[rows] = (docs + rows, total_seconds + seconds)
+        return {rows: docs / seconds
+            for rows, (docs, seconds) in stats.items() if seconds > 0}
+
 
-        for record in self.collection_data:
-            try:
-                if search_value.lower() in record[field].lower():
-                    result_list.append(record)
-            except KeyError:
-                raise Exception('field not present. Check your RepositoryQuery instance fields')
+    def iter_docs(self, url, total, date_params=None, session=None,
+        fields=None, metrics=None):
+        """
+        Yield documents page by page until total docs are read
+        or an empty page is returned.
+
+        Parameters:
+            url: collection api url
+            total: row total, i.e. from get_row_total
+            date_params: dict of query params, i.e. from/until and fl
+            session: http_session Session used for requests
+            fields: document fields to keep, all fields if None.
+                Ignored with cursor paging, which needs the
+                whole response.
+            metrics: metrics.Metrics requests are recorded in
+
+        Returns:
+            generator of IR records.
+        """
+        start = 0
+        cursor = '*' if self.cursor else None
+
+        while start < total:
+            params = dict(date_params or {})
+            params['rows'] = self.row_num
+            # sort is kept after falling back to start offsets, so
+            # later pages continue page 0's order
+            if self.cursor:
+                params['sort'] = 'PID asc'
+            if cursor is not None:
+                params['cursorMark'] = cursor
+            else:
+                params['start'] = start
+
+            begin = time.perf_counter()
+            r = make_request(url, params=params, session=session,
+                metrics=metrics)
+            if cursor is not None:
+                data = loads(r.content)
+                docs = data['response']['docs']
+            else:
+                docs = decode_page(r.content, fields, metrics)
+            seconds = time.perf_counter() - begin
+
+            self.history.append((len(docs), seconds, len(r.content)))
+            yield from docs
+
+            if not docs:
+                break
+            start += len(docs)
+
+            if cursor is not None:
+                next_cursor = data.get('nextCursorMark')
+                if next_cursor == cursor:
+                    break
+                cursor = next_cursor
 
-        return result_list     
+            self.tune(len(docs), seconds, len(r.content))
 
 
 class DataExporter():
@@ -222,8 +676,13 @@ class DataExporter():
     date_info = datetime.now().strftime("%Y_%m_%d") + ".csv"
     col_fname = "noaa_collection_" + date_info
 
+    def __init__(self, metrics=None):
+        # metrics.Metrics write timings are recorded in. Shared
+        # Metrics, disabled unless configured, used if None
+        self.metrics = metrics or get_metrics()
+
     def export_collection_as_csv(self, repository_query, collection_pid,
-        export_path='.', col_fname=col_fname):
+        export_path='.', col_fname=col_fname, stream=False):
         
         """
         Export single collection in a CSV.
@@ -235,6 +694,8 @@ class DataExporter():
                 set to current working directory
             col_fname: DataExporter class attribute ued as 
                 keyword default param 
+            stream: write rows page by page as they arrive instead of
+                loading the collection into collection_data first.
 
         Returns:
             CSV of a single IR collection.
@@ -242,18 +703,146 @@ class DataExporter():
         # creates directory if it doesn't exists
         make_dir(export_path)
         
-        data = repository_query.get_single_collection_json(collection_pid)
-        records = repository_query.filter_on_fields()
+        if stream:
+            records = repository_query.iter_fields(
+                repository_query.iter_collection_json(collection_pid))
+        else:
+            repository_query.get_single_collection_json(collection_pid)
+            repository_query.filter_on_fields()
+            records = repository_query.collection_data
 
         collection_full_path = os.path.join(export_path, col_fname)
 
+        # with stream, write time includes harvesting
         delimiter = '\t'
-        write_dict_list_to_csv(records,collection_full_path,
-            delimiter, repository_query.fields)
+        with self.metrics.stage('write_csv'):
+            write_dict_list_to_csv(records,collection_full_path,
+                delimiter, repository_query.fields)
+
+
+    def export_collection_columnar(self, repository_query, collection_pid,
+        export_path='.', fname=None, file_format='parquet',
+        row_group_size=50000):
+        """
+        Export single collection, or 'noaa' for entire IR, as
+        Parquet or Arrow IPC stream. Records are streamed and
+        written one row group at a time.
+
+        Requires pyarrow.
+
+        Parameters:
+            reposistory_query: ReposistoryQuery class instance
+            collection_pid: collection pid value
+            export_path: path to download collection file to. Default is
+                set to current working directory
+            fname: file name. Defaults to dated noaa_collection_
+                file with .parquet or .arrows extension
+            file_format: 'parquet' or 'arrow'
+            row_group_size: rows per row group
+
+        Returns:
+            number of rows written.
+        """
+        # creates directory if it doesn't exists
+        make_dir(export_path)
+
+        if fname is None:
+            extension = '.parquet' if file_format == 'parquet' else '.arrows'
+            fname = self.col_fname.replace('.csv', extension)
+
+        records = repository_query.iter_fields(
+            repository_query.iter_collection_json(collection_pid))
+
+        with self.metrics.stage('write_columnar'):
+            return write_records_columnar(records,
+                os.path.join(export_path, fname), repository_query.fields,
+                file_format, row_group_size)
+
+
+    def export_collection_incremental(self, repository_query, collection_pid,
+        export_path='.', col_fname=None, state_file='harvest_state.json',
+        date_field='fgs.createdDate'):
+        """
+        Incrementally sync a single collection CSV snapshot.
+
+        A per-collection high-water mark (latest date_field value seen)
+        is stored in state_file. If a watermark and snapshot exist, only
+        items since the watermark are requested and merged into the
+        snapshot by PID. Otherwise the full collection is harvested.
+
+        Parameters:
+            reposistory_query: ReposistoryQuery class instance
+            collection_pid: collection pid value, 'noaa' for entire IR
+            export_path: path snapshot and state file are written to.
+                Default is set to current working directory
+            col_fname: snapshot file name. Defaults to
+                noaa_collection_<pid>.csv
+            state_file: JSON file of watermarks keyed on pid
+            date_field: document date field used as watermark
+
+        Returns:
+            number of new or updated records merged into snapshot.
+        """
+        # creates directory if it doesn't exists
+        make_dir(export_path)
 
+        collection_pid = str(collection_pid)
+        if col_fname is None:
+            col_fname = f'noaa_collection_{collection_pid}.csv'
 
-    def export_all_collections_as_csv(self, repository_query, all_ir_data,
-        export_path='.'):
+        collection_full_path = os.path.join(export_path, col_fname)
+        state_full_path = os.path.join(export_path, state_file)
+
+        watermarks = load_watermarks(state_full_path)
+        watermark = watermarks.get(collection_pid)
+
+        incremental = watermark is not None and \
+            os.path.exists(collection_full_path)
+        date_params = repository_query.date_params
+        try:
+            if incremental:
+                repository_query.watermark_filter(watermark)
+
+            # track latest date while streaming raw docs
+            latest = [watermark or '']
+            def track_dates(docs):
+                for doc in docs:
+                    value = doc.get(date_field) or ''
+                    if value > latest[0]:
+                        latest[0] = value
+                    yield doc
+
+            records = repository_query.iter_fields(track_dates(
+                repository_query.iter_collection_json(collection_pid,
+                    [date_field])))
+
+            if incremental:
+                new_records = {r['PID']: r for r in records}
+                merged = merge_snapshot(collection_full_path, new_records)
+            else:
+                new_records = list(records)
+                merged = new_records
+
+            delimiter = '\t'
+            tmp_path = collection_full_path + '.tmp'
+            with self.metrics.stage('write_csv'):
+                write_dict_list_to_csv(merged, tmp_path,
+                    delimiter, repository_query.fields)
+            os.replace(tmp_path, collection_full_path)
+        finally:
+            # restored even if the harvest or write fails
+            repository_query.date_params = date_params
+
+        # only advance watermark once snapshot is written
+        if latest[0]:
+            watermarks[collection_pid] = latest[0]
+            save_watermarks(state_full_path, watermarks)
+
+        return len(new_records)
+
+
+    def export_all_collections_as_csv(self, repository_query, all_ir_data=None,
+        export_path='.', stream=False, key_fields=('PID',)):
         """ 
         Creates a unique file of all its in the IR.
 
@@ -265,6 +854,10 @@ class DataExporter():
             JSON and then is looped through.
             export_path: path to download collection file to. Default is
                 set to current working directory
+            stream: write rows page by page as they arrive instead of
+                loading the collection into collection_data first.
+            key_fields: fields used to identify duplicate records. 
+                First seen record is kept.
         
         Returns:
             CSV of all IR collections.   
@@ -273,25 +866,24 @@ class DataExporter():
          # creates directory if it doesn't exists
         make_dir(export_path)
 
-        data = repository_query.get_all_collections_json()
-        records = repository_query.filter_on_fields()
+        if stream:
+            records = repository_query.iter_fields(
+                repository_query.iter_collection_json('noaa'))
+        else:
+            repository_query.get_all_collections_json()
+            repository_query.filter_on_fields()
+            records = repository_query.collection_data
 
-        # calls api.get method  which call JSON API to retrieve all collections 
-        collections_file = "noaa_collections_" + self.date_info
-        collections_full_path = os.path.join(export_path, collections_file)
         deduped_collections_file = "noaa_collections_final_" + self.date_info
         deduped_collections_full_path = os.path.join(export_path,
             deduped_collections_file)     
         
+        # deduplicate records inline while writing
         delimiter = '\t'
-        write_dict_list_to_csv(records, collections_full_path, 
-            delimiter, repository_query.fields)
-
-        # deduplicate files
-        f = list(set(open(collections_full_path,encoding='utf-8').readlines()))
-        f.insert(0,delimiter.join(repository_query.fields) + '\n')
-        open(deduped_collections_full_path,'w', encoding='utf-8').writelines(f)
-        os.remove(collections_full_path)
+        with self.metrics.stage('write_csv'):
+            write_dict_list_to_csv(dedupe_records(records, key_fields),
+                deduped_collections_full_path, delimiter,
+                repository_query.fields)
 
 
 def field_iterator(json_data, fields):
@@ -301,123 +893,466 @@ def field_iterator(json_data, fields):
     Return dict
     """
 
-    data_dict = {}
+    return dict(zip(fields, field_values(json_data, fields)))
+
+
+def field_values(json_data, fields):
+    """
+    Helper function. Cleaned values of fields, multiple
+    values joined with '~'.
+
+    Return list
+    """
+
+    values = []
 
     delimiter = '~'
     for field in fields:
-        if json_data.get(field) is None:
-            data_dict.update({field: ''})
-        elif isinstance(json_data.get(field), list): 
+        value = json_data.get(field)
+        if value is None:
+            values.append('')
+        elif isinstance(value, list): 
             # delimter
-            data_dict.update({field: clean_text(delimiter.join(json_data.get(field)))})
+            values.append(clean_text(delimiter.join(value)))
         else:
-            data_dict.update({field: clean_text(json_data.get(field))})
+            values.append(clean_text(value))
+
+    return values
 
-    return data_dict
 
+def dedupe_records(records, key_fields=('PID',)):
+    """
+    Drop duplicate records, preserving first-seen order.
+
+    Only an 8 byte digest of each record's key fields is kept
+    in memory rather than the records themselves.
 
-def make_request(url,params=None):
+    Parameters:
+        records: iterable of dicts
+        key_fields: fields that identify a record
+
+    Returns:
+        generator of unique records.
     """
-    Make request. Check for 200 status code. If not exit
-    script with sys.exit.  
+
+    seen = set()
+    for record in records:
+        key = '\x1f'.join(str(record.get(f, '')) for f in key_fields)
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        if digest not in seen:
+            seen.add(digest)
+            yield record
+
+
+def collection_memberships(json_data, field='RELS_EXT_isMemberOfCollection_uri_ms'):
+    """
+    Helper function. Collection pids a document is a member of.
+
+    Membership values look like 'info:fedora/noaa:7'; the
+    trailing pid is kept so it can be matched against pid_dict.
+
+    Parameters:
+        json_data: IR document
+        field: document field listing parent collections
+
+    Returns:
+        set of collection pid strings.
+    """
+
+    values = json_data.get(field) or []
+    if isinstance(values, str):
+        values = [values]
+
+    return {re.split('[:/]', value)[-1] for value in values}
+
+
+def make_request(url,params=None, session=None, metrics=None):
+    """
+    Make request. Check for 200 status code. Transient failures
+    are retried by the session before giving up.
     
     Parameters:
         url: api url string.
+        session: http_session Session. Shared session used if None.
+        metrics: metrics.Metrics latency and bytes are recorded in.
+            Shared Metrics used if None.
     
     Returns:
-        Returns response, if not returns
-        message and quit program.
+        Returns response, if not raises exception.
     """
-    r = requests.get(url,params=params)
+    session = session or get_session()
+    metrics = metrics or get_metrics()
+
+    begin = time.perf_counter()
+    r = session.get(url,params=params)
+    metrics.request(time.perf_counter() - begin, len(r.content))
+
     if r.status_code != 200:
-        return 'status code did not return 200'
-        sys.exit(1)
+        raise Exception(f'{url} returned status code {r.status_code}')
     return r
 
 
-def get_row_total(api_url, pid):
+def get_row_total(api_url, pid, session=None, metrics=None,
+    date_params=None):
     """
     Get row total from collection. 
 
     Returns row total for each collection, 
-    including entire NOAA IR collection.
+    including entire NOAA IR collection, within date_params
+    if given.
     """
 
-    r = requests.get(f'{api_url}{pid}')
-    if r.status_code != 200:
-        return 'status code did not return 200'
-        sys.exit(1)
-    data = r.json()
-    return data['response']['numFound']
+    return probe_collection(api_url, pid, date_params, session, metrics)[0]
+
+
+def get_row_totals(api_url, pids, params=None, session=None,
+    metrics=None, max_workers=4, fields=None):
+    """
+    Count probe several collections, up to max_workers
+    count probes at a time.
+
+    Parameters:
+        params: query params, i.e. from/until and fl
+        fields: document fields to keep, all fields if None.
+
+    Returns:
+        dict of pid: (row total, docs), as from probe_collection.
+    """
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        probes = executor.map(lambda pid: probe_collection(api_url, pid,
+            params, session, metrics, fields), pids)
+        return dict(zip(pids, probes))
 
 
-def iterate_rows(api_url, col_pid, total, row_num=5000): 
+def probe_collection(api_url, pid, params=None, session=None, metrics=None,
+    fields=None):
+    """
+    Count probe. Requests zero rows so only numFound is returned.
+
+    Parameters:
+        api_url: collection api url, without pid
+        pid: collection pid
+        params: query params, i.e. from/until and fl
+        session: http_session Session used for requests
+        metrics: metrics.Metrics request is recorded in
+        fields: document fields to keep, all fields if None.
+
+    Returns:
+        tuple of (row total, docs). Docs are page 0 of the collection
+        if the endpoint ignored rows=0, otherwise an empty list.
+    """
+
+    params = dict(params or {})
+    params['rows'] = 0
+
+    r = make_request(f'{api_url}{pid}', params=params, session=session,
+        metrics=metrics)
+    data = loads(r.content)['response']
+
+    docs = data.get('docs') or []
+    if docs and fields is not None:
+        docs = [{f: doc[f] for f in fields if f in doc} for doc in docs]
+    return data['numFound'], docs
+
+
+def iterate_rows(api_url, col_pid, total, row_num=5000, start=0): 
     """
     If total number of rows is less than 
     chunk val a list of URLS is generated with 
-    a num appended with a query string
+    a num appended with a query string.
+
+    One url is generated per row_num start offset, the last
+    url covering any remaining partial page. If start is given,
+    i.e. page 0 is already fetched, urls begin at start.
     """
 
     # append collection col_pid to api_url
     url = f'{api_url}{col_pid}'
 
-    if total < row_num:
+    if start == 0 and total < row_num:
         return url
     else:
-        chunk_array = split_equal(total, row_num)
-        # insert 0 at beginning of list
-        chunk_array.insert(0,0) 
-        cumsum_chunk_array = list(accumulate(chunk_array))
-
-        chunk_link_array = []
-        for chunk in cumsum_chunk_array:
-            if chunk != total:
-                chunk_link_array.append(
-                    f'{url}?rows={str(row_num)}&start={str(chunk)}')
-                continue
-        return chunk_link_array
+        return [f'{url}?rows={str(row_num)}&start={str(offset)}'
+            for offset in range(start, total, row_num)]
 
-    
-def split_equal(total, row_num):
-    """
-    Helper function for iterate_rows function
-    """
-    li = [row_num] * math.floor((total / row_num))
-    return li
 
-
-def concat_json(api_url_info, full_url, date_params=None):
+def concat_json(api_url_info, full_url, date_params=None, max_workers=1,
+    session=None, checkpoint_dir=None, fields=None, metrics=None):
     """
     Function utilized to handle multiple or single api URL requests.
 
     If multiple API URL requests are occur, requests are made
-    using list comprehensions resulting in lists of dicts. Lists
-    are combined using itertools chain. 
+    concurrently using a thread pool, resulting in lists of dicts. 
+    Pages are returned in start offset order and combined 
+    using itertools chain. 
 
     If single API request is made, only list of dicts is returned.
 
+    Parameters:
+        api_url_info: url string or list of url strings from iterate_rows
+        full_url: collection api url
+        date_params: dict of query params, i.e. from/until and fl
+        max_workers: max number of requests in flight. Default 1
+            makes requests one after another.
+        session: http_session Session used for requests.
+        checkpoint_dir: directory completed pages are saved to.
+            Pages already saved there are read instead of requested.
+        fields: document fields to keep, all fields if None.
+        metrics: metrics.Metrics requests and decoding are recorded in
+
     Returns:
         list of IR records. Response header is removed in the process. 
         Neccessary for concating JSON.  
     """
     
     # if api_url_info contains multiple links are present
-    if isinstance(api_url_info, list):
-        r = [make_request(url, params=date_params) for url in api_url_info]
-        data = [x.json() for x in r]
-        docs = [x['response']['docs'] for x in data]
+    if isinstance(api_url_info, list) and checkpoint_dir is not None:
+        docs = fetch_checkpointed_pages(api_url_info, date_params,
+            max_workers, session, checkpoint_dir, fields, metrics)
+        docs = list(chain(*docs))
+
+    elif isinstance(api_url_info, list):
+        r = fetch_pages(api_url_info, date_params, max_workers, session,
+            metrics)
+        docs = [decode_page(x.content, fields, metrics) for x in r]
         #use itertools chain to concat lists together
         docs = list(chain(*docs))
     
     # if a single link is present
     elif isinstance(api_url_info, str):
-        r = make_request(full_url, params=date_params)
-        data = r.json()
-        docs = data['response']['docs']
+        r = make_request(full_url, params=date_params, session=session,
+            metrics=metrics)
+        docs = decode_page(r.content, fields, metrics)
+
+    return docs
+
+
+def fetch_pages(urls, params=None, max_workers=1, session=None,
+    metrics=None):
+    """
+    Request a list of page urls, up to max_workers at a time.
+
+    Parameters:
+        urls: list of api url strings
+        params: query params passed along with each request
+        max_workers: max number of requests in flight
+        session: http_session Session used for requests
+        metrics: metrics.Metrics requests are recorded in
+
+    Returns:
+        list of responses, in the same order as urls.
+    """
+
+    if max_workers <= 1 or len(urls) <= 1:
+        return [make_request(url, params=params, session=session,
+            metrics=metrics) for url in urls]
+
+    # executor.map yields results in input order, which keeps
+    # docs in start offset order regardless of completion order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda url: make_request(url, params=params, session=session,
+                metrics=metrics),
+            urls))
+
+
+def decode_page(content, fields=None, metrics=None):
+    """
+    Decode page docs, recording decode time and record count.
+
+    Parameters:
+        content: response body bytes
+        fields: document fields to keep, all fields if None.
+        metrics: metrics.Metrics. Shared Metrics used if None.
+
+    Returns:
+        list of documents.
+    """
 
+    metrics = metrics or get_metrics()
+    with metrics.stage('decode'):
+        docs = decode_docs(content, fields)
+    metrics.add('records', len(docs))
     return docs
 
 
+def fetch_checkpointed_pages(urls, params=None, max_workers=1, session=None,
+    checkpoint_dir='.', fields=None, metrics=None):
+    """
+    Request a list of page urls, saving each page's docs to
+    checkpoint_dir as it completes. Pages already in checkpoint_dir
+    are loaded from disk, so an interrupted harvest resumes from
+    the pages it hadn't finished.
+
+    Parameters:
+        urls: list of api url strings
+        params: query params passed along with each request
+        max_workers: max number of requests in flight
+        session: http_session Session used for requests
+        checkpoint_dir: directory page files are written to
+        fields: document fields to keep, all fields if None.
+        metrics: metrics.Metrics requests and decoding are recorded in
+
+    Returns:
+        list of doc lists, in the same order as urls.
+    """
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def fetch(url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json'
+        page_path = os.path.join(checkpoint_dir, name)
+        if os.path.exists(page_path):
+            with open(page_path, encoding='utf-8') as fh:
+                return json.load(fh)
+
+        docs = decode_page(make_request(url, params=params,
+            session=session, metrics=metrics).content, fields, metrics)
+
+        # write then rename so partial files are never read back
+        with open(page_path + '.tmp', 'w', encoding='utf-8') as fh:
+            json.dump(docs, fh)
+        os.replace(page_path + '.tmp', page_path)
+        return docs
+
+    if max_workers <= 1:
+        return [fetch(url) for url in urls]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch, urls))
+
+
+def harvest_checkpoint_dir(checkpoint_dir, full_url, date_params=None,
+    fields=None):
+    """
+    Checkpoint directory for a single harvest, keyed on collection
+    url, date params and decoded fields so different harvests
+    don't mix pages.
+
+    Returns:
+        directory path string.
+    """
+    key = json.dumps([full_url, sorted((date_params or {}).items()),
+        fields])
+    return os.path.join(checkpoint_dir,
+        hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+
+def iter_json(api_url_info, full_url, date_params=None, max_workers=1,
+    session=None, fields=None, metrics=None):
+    """
+    Generator version of concat_json.
+
+    Documents are yielded page by page in start offset order. At most
+    max_workers pages are requested ahead of the page being consumed,
+    so only those pages are held in memory.
+
+    Returns:
+        generator of IR records.
+    """
+
+    if isinstance(api_url_info, str):
+        api_url_info = [full_url]
+
+    if max_workers <= 1:
+        for url in api_url_info:
+            r = make_request(url, params=date_params, session=session,
+                metrics=metrics)
+            yield from decode_page(r.content, fields, metrics)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        urls = iter(api_url_info)
+
+        # keep max_workers requests in flight ahead of consumer
+        for url in urls:
+            pending.append(executor.submit(make_request, url,
+                params=date_params, session=session, metrics=metrics))
+            if len(pending) >= max_workers:
+                break
+
+        while pending:
+            r = pending.popleft().result()
+            url = next(urls, None)
+            if url is not None:
+                pending.append(executor.submit(make_request, url,
+                    params=date_params, session=session, metrics=metrics))
+            yield from decode_page(r.content, fields, metrics)
+
+
+def load_watermarks(file_path):
+    """
+    Load per-collection watermarks.
+
+    Parameters:
+        file_path: JSON state file
+
+    Returns:
+        dict of pid: date string. Empty if file doesn't exist.
+    """
+    if os.path.exists(file_path) == False:
+        return {}
+    with open(file_path, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def save_watermarks(file_path, watermarks):
+    """
+    Save per-collection watermarks.
+
+    Parameters:
+        file_path: JSON state file
+        watermarks: dict of pid: date string
+    """
+    with open(file_path, 'w', encoding='utf-8') as fh:
+        json.dump(watermarks, fh, indent=2)
+
+
+def merge_snapshot(file_path, new_records):
+    """
+    Merge records into a previous CSV snapshot.
+
+    Snapshot rows with a PID in new_records are replaced, keeping
+    their position. Remaining new records are appended.
+
+    Parameters:
+        file_path: previous snapshot CSV
+        new_records: dict of PID: record
+
+    Returns:
+        generator of merged records.
+    """
+    seen = set()
+    with open(file_path, newline='', encoding='utf-8') as fh:
+        for row in csv.DictReader(fh, delimiter='\t'):
+            pid = row.get('PID')
+            if pid in new_records:
+                seen.add(pid)
+                yield new_records[pid]
+            else:
+                yield row
+
+    for pid, record in new_records.items():
+        if pid not in seen:
+            yield record
+
+
+def date_param_format(date):
+    """
+    Check if date param format is valid.
+
+    Parameters:
+        date: 'YYYY-MM-DD' string
+
+    Returns:
+        date string if valid, otherwise ValueError raised.
+    """
+    datetime.strptime(date, '%Y-%m-%d')
+    return date
+
+
 def check_pid(collection_info, pid):
     """
     Checks to see if pid is a valid pid repo collection pid.
@@ -452,7 +1387,7 @@ def clean_text(text):
     """
     Clean text data.
     """
-    text = text.replace('\n', '').replace('\r','')
+    text = text.translate(clean_table)
     return text
 
 
@@ -0,0 +1,348 @@
+import os, json, argparse, tempfile
+from datetime import datetime
+
+"""
+Non-interactive batch exports driven by a JSON job spec, for cron
+jobs and other scripted runs.
+
+    python batch.py jobs.json [--dry-run] [--cache-dir DIR]
+        [--metrics-file FILE] [--max-workers N]
+
+Job spec:
+
+    {
+      "fields": ["PID", "mods.title", "fgs.createdDate"],
+      "jobs": [
+        {"collections": ["noaa"], "formats": ["csv", "parquet"],
+         "destination": "exports"},
+        {"collections": ["7", "National Weather Service (NWS)"],
+         "from": "2020-01-01", "until": "2021-01-01",
+         "fields": ["PID", "mods.title"], "formats": ["csv"],
+         "destination": "exports/dated"}
+      ]
+    }
+
+Collections are pids or pid_dict names. Job fields default to the
+top level fields. from/until are optional 'YYYY-MM-DD' dates. An
+optional top level api_url replaces the RepositoryQuery api_url,
+i.e. for a mirror or benchmarks/solr_server.py.
+
+Jobs are planned into the fewest harvests: each collection is
+harvested once per date window with the union of fields its outputs
+need, and if the entire IR ('noaa') is harvested for a window, every
+other collection in that window is taken from it by item membership
+instead of being harvested again.
+
+api_query (and with it requests) is only imported once a spec is
+loaded, and pyarrow only for columnar outputs, so --help starts
+quickly. --dry-run imports api_query for the collection pids.
+
+Two outputs that would write the same file with different fields
+are rejected, i.e. jobs for one collection, window, destination and
+format must use the same fields.
+"""
+
+# output format: file extension
+formats = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrows',
+    'snapshot': '.snapshot'
+    }
+
+membership_field = 'RELS_EXT_isMemberOfCollection_uri_ms'
+
+today = datetime.now().strftime('%Y-%m-%d')
+
+
+def load_spec(file_path):
+    """
+    Load and validate a job spec.
+
+    Parameters:
+        file_path: JSON job spec file path
+
+    Returns:
+        job spec dict. ValueError raised if spec is invalid.
+    """
+    with open(file_path, encoding='utf-8') as fh:
+        spec = json.load(fh)
+
+    jobs = spec.get('jobs')
+    if not jobs:
+        raise ValueError(f'{file_path} has no jobs')
+
+    for i, job in enumerate(jobs):
+        if not job.get('collections'):
+            raise ValueError(f'job {i} has no collections')
+        if not job.get('fields', spec.get('fields')):
+            raise ValueError(f'job {i} has no fields')
+        for file_format in job.get('formats', ['csv']):
+            if file_format not in formats:
+                raise ValueError(f'job {i} format {file_format} must be '
+                    f'one of {", ".join(formats)}')
+        for key in ('from', 'until'):
+            if job.get(key) is not None:
+                datetime.strptime(job[key], '%Y-%m-%d')
+        if job.get('until') is not None and job.get('from') is None:
+            raise ValueError(f'job {i} has until without from')
+
+    return spec
+
+
+def resolve_pid(value, pid_dict):
+    """
+    Collection pid from a pid or pid_dict collection name.
+
+    Returns:
+        pid string. ValueError raised if value isn't a collection.
+    """
+    value = str(value)
+    if value in pid_dict.values():
+        return value
+    if value in pid_dict:
+        return pid_dict[value]
+    raise ValueError(f'{value} is not a valid collection pid or name')
+
+
+def plan_harvests(spec, pid_dict):
+    """
+    Plan the harvests needed to produce every job output.
+
+    Parameters:
+        spec: job spec, i.e. from load_spec
+        pid_dict: dict of collection name: pid
+
+    Returns:
+        list of harvest dicts with pid, window (from, until), fields,
+        route (outputs are routed by collection membership) and
+        outputs, each a dict of pid, fields, format and path.
+        ValueError raised if two outputs with different fields
+        have the same path.
+    """
+    # window: pid: outputs
+    windows = {}
+    # normalized path: output
+    paths = {}
+    for job in spec['jobs']:
+        fields = list(job.get('fields', spec.get('fields')))
+        from_d = job.get('from')
+        until_d = job.get('until', today if from_d else None)
+        window = (from_d, until_d)
+        destination = job.get('destination', '.')
+
+        for collection in job['collections']:
+            pid = resolve_pid(collection, pid_dict)
+            name = f'noaa_collection_{pid}'
+            if from_d is not None:
+                name += f'_{from_d}_{until_d}'
+
+            for file_format in job.get('formats', ['csv']):
+                path = os.path.join(destination, name + formats[file_format])
+                outputs = windows.setdefault(window, {}).setdefault(pid, [])
+                output = {'pid': pid, 'fields': fields,
+                    'format': file_format, 'path': path}
+                if paths.setdefault(os.path.normpath(path), output) != output:
+                    raise ValueError(f'{path} is written by more than '
+                        'one job with different fields')
+                if output not in outputs:
+                    outputs.append(output)
+
+    harvests = []
+    for window, by_pid in windows.items():
+        # entire IR is harvested anyway, collections come from it
+        if 'noaa' in by_pid and len(by_pid) > 1:
+            outputs = [o for pid in by_pid for o in by_pid[pid]]
+            harvests.append({'pid': 'noaa', 'window': window,
+                'fields': union_fields(outputs, [membership_field]),
+                'route': True, 'outputs': outputs})
+            continue
+
+        for pid, outputs in by_pid.items():
+            harvests.append({'pid': pid, 'window': window,
+                'fields': union_fields(outputs), 'route': False,
+                'outputs': outputs})
+
+    return harvests
+
+
+def union_fields(outputs, extra_fields=()):
+    """
+    Fields needed by any of outputs, in first seen order.
+
+    Returns:
+        list of fields.
+    """
+    fields = [f for o in outputs for f in o['fields']]
+    return list(dict.fromkeys(fields + list(extra_fields)))
+
+
+def run_harvest(repository_query, harvest, tmp_dir):
+    """
+    Harvest a collection once and write each of its outputs.
+
+    A harvest with a single output is streamed straight to it.
+    Otherwise documents are written to a snapshot in tmp_dir
+    and each output reads from the snapshot.
+
+    Parameters:
+        repository_query: RepositoryQuery class instance
+        harvest: harvest dict from plan_harvests
+        tmp_dir: directory for intermediate snapshots
+    """
+    from api_query import check_pid
+    from snapshot import Snapshot, write_snapshot
+
+    q = repository_query
+    q.fields = harvest['fields']
+    from_d, until_d = harvest['window']
+    if from_d is None:
+        q.date_params = {}
+    else:
+        q.date_filter(from_d, until_d)
+
+    pid = check_pid(q.pid_dict, harvest['pid'])
+    docs = q.iter_collection_json(pid)
+
+    outputs = harvest['outputs']
+    if len(outputs) == 1 and not harvest['route']:
+        write_output(outputs[0], docs)
+        return
+
+    snapshot_path = os.path.join(tmp_dir, f'{pid}.snapshot')
+    write_snapshot(snapshot_path, docs, harvest['fields'])
+    snapshot = Snapshot(snapshot_path)
+    try:
+        for output in outputs:
+            member = output['pid'] if harvest['route'] else None
+            write_output(output,
+                snapshot_records(snapshot, output['fields'], member))
+    finally:
+        snapshot.close()
+        os.remove(snapshot_path)
+
+
+def snapshot_records(snapshot, fields, member=None):
+    """
+    Records of a snapshot, projected to fields.
+
+    Parameters:
+        snapshot: Snapshot holding harvested documents
+        fields: record fields
+        member: only records of items in this collection pid,
+            read from membership_field. All records if None or 'noaa'.
+
+    Returns:
+        generator of Records, shaped like filter_on_fields output.
+    """
+    from api_query import collection_memberships
+    from records import record_type, clean_table
+
+    record = record_type(fields)
+    for i in range(len(snapshot)):
+        if member not in (None, 'noaa'):
+            doc = {membership_field: snapshot.values(membership_field, i)}
+            if member not in collection_memberships(doc):
+                continue
+        yield record('~'.join(snapshot.values(f, i)).translate(clean_table)
+            for f in fields)
+
+
+def write_output(output, records):
+    """
+    Write records, or raw documents, to an output file.
+
+    Parameters:
+        output: output dict from plan_harvests
+        records: iterable of records or documents
+    """
+    from api_query import field_values, write_dict_list_to_csv
+    from records import record_type
+
+    fields = output['fields']
+    file_format = output['format']
+
+    # documents from a streamed harvest are cleaned and projected
+    record = record_type(fields)
+    records = (r if type(r) is record else record(field_values(r, fields))
+        for r in records)
+
+    destination = os.path.dirname(output['path'])
+    if destination:
+        os.makedirs(destination, exist_ok=True)
+
+    if file_format == 'csv':
+        write_dict_list_to_csv(records, output['path'], '\t', fields)
+    elif file_format == 'snapshot':
+        from snapshot import write_snapshot
+        write_snapshot(output['path'], records, fields)
+    else:
+        from arrow_export import write_records_columnar
+        write_records_columnar(records, output['path'], fields, file_format)
+
+    print(f"WRITTEN: {output['path']}")
+
+
+def run(spec, max_workers=4, cache_dir=None, metrics_file=None):
+    """
+    Run every job in spec.
+
+    Parameters:
+        spec: job spec, i.e. from load_spec
+        max_workers: max number of page requests in flight
+        cache_dir: on-disk response cache directory, none if None
+        metrics_file: JSON file stage timings are written to
+
+    Returns:
+        list of harvests run.
+    """
+    from api_query import RepositoryQuery
+    from http_session import configure_session
+    from metrics import Metrics
+
+    session = configure_session(cache_dir=cache_dir)
+    metrics = Metrics(enabled=metrics_file is not None)
+    q = RepositoryQuery([], max_workers, session, metrics)
+    # outputs only hold job fields, so request only those
+    q.field_projection = True
+    if spec.get('api_url'):
+        q.api_url = spec['api_url']
+
+    harvests = plan_harvests(spec, q.pid_dict)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for harvest in harvests:
+            print(f"HARVESTING: {harvest['pid']} {harvest['window']}...")
+            run_harvest(q, harvest, tmp_dir)
+
+    if metrics_file is not None:
+        metrics.to_json(metrics_file)
+    return harvests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run NOAA IR exports from a JSON job spec.')
+    parser.add_argument('spec', help='JSON job spec file')
+    parser.add_argument('--dry-run', action='store_true',
+        help='print planned harvests without running them')
+    parser.add_argument('--cache-dir', default=None,
+        help='on-disk response cache directory')
+    parser.add_argument('--metrics-file', default=None,
+        help='write stage timings to this JSON file')
+    parser.add_argument('--max-workers', type=int, default=4,
+        help='max page requests in flight')
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+
+    if args.dry_run:
+        from api_query import RepositoryQuery
+        harvests = plan_harvests(spec, RepositoryQuery.pid_dict)
+        print(json.dumps(harvests, indent=2))
+        return
+
+    run(spec, args.max_workers, args.cache_dir, args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os, sys, json, time, argparse, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import json_decode
+
+"""
+Decode time and allocations for a 5000-row API page.
+
+Compares stdlib json, orjson and ijson field projection (each only
+if installed). Uses a recorded page if given, otherwise a synthetic
+page shaped like a Solr export response.
+
+Usage:
+    python benchmarks/bench_json_decode.py [--page recorded_page.json]
+"""
+
+fields = [ 'PID', 'mods.title','mods.type_of_resource',
+    'fgs.createdDate','mods.sm_digital_object_identifier',
+    'mods.related_series','mods.ss_publishyear', 'mods.sm_localcorpname']
+
+
+def synthetic_page(rows=5000):
+    """JSON bytes of a page with requested fields plus unused ones."""
+    docs = []
+    for i in range(rows):
+        docs.append({
+            'PID': f'noaa:{i}',
+            'mods.title': f'Technical memorandum {i}',
+            'mods.type_of_resource': ['text', 'still image'][:1 + i % 2],
+            'fgs.createdDate': '2020-01-01T00:00:00Z',
+            'mods.sm_digital_object_identifier': [f'10.0000/{i}'],
+            'mods.related_series': 'NOAA technical memorandum',
+            'mods.ss_publishyear': '2020',
+            'mods.sm_localcorpname': ['National Weather Service',
+                'Office of Oceanic and Atmospheric Research'][:1 + i % 2],
+            # unused fields, as returned by the export endpoint
+            'mods.abstract': 'Abstract text. ' * 40,
+            'mods.sm_subject': [f'subject {j}' for j in range(10)],
+            'fgs.ownerId': 'fedoraAdmin',
+            'RELS_EXT_isMemberOfCollection_uri_ms': ['info:fedora/noaa:7'],
+            })
+    return json.dumps({'responseHeader': {'status': 0},
+        'response': {'numFound': rows, 'start': 0, 'docs': docs}}
+        ).encode('utf-8')
+
+
+def measure(decode, content, repeat=5):
+    """Best of repeat wall time, plus peak traced allocation."""
+    best = None
+    for i in range(repeat):
+        begin = time.perf_counter()
+        decode(content)
+        seconds = time.perf_counter() - begin
+        best = seconds if best is None else min(best, seconds)
+
+    tracemalloc.start()
+    decode(content)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': best, 'peak_alloc_mb': peak / 1024 / 1024}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--page', default=None,
+        help='recorded page response, defaults to a synthetic page')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.page:
+        with open(args.page, 'rb') as fh:
+            content = fh.read()
+    else:
+        content = synthetic_page()
+
+    results = {'page_mb': len(content) / 1024 / 1024}
+    results['json'] = measure(
+        lambda c: json.loads(c)['response']['docs'], content, args.repeat)
+
+    if json_decode.orjson is not None:
+        results['orjson'] = measure(
+            lambda c: json_decode.orjson.loads(c)['response']['docs'],
+            content, args.repeat)
+
+    if json_decode.ijson is not None:
+        results['ijson_fields'] = measure(
+            lambda c: json_decode.parse_docs(c, fields),
+            content, args.repeat)
+
+    results['decode_docs_fields'] = measure(
+        lambda c: json_decode.decode_docs(c, fields), content, args.repeat)
+
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,76 @@
+import os, sys, json, time, argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from stats import convert_df_list_to_str, normalize_doc_types
+
+"""
+mods.type_of_resource normalization on a synthetic frame.
+
+Compares convert_df_list_to_str with the previous copy/drop/append
+implementation (using pd.concat, since DataFrame.append was removed
+from pandas). The previous version only handled up to two types per
+record, so the multi-type rows here have exactly two.
+
+Usage:
+    python benchmarks/doc_types.py [--rows 200000] [--multi-ratio 0.15]
+"""
+
+resource = 'mods.type_of_resource'
+doc_types = ['text', 'Text', 'still image', 'cartographic',
+    'moving image', 'software', 'mixed material']
+
+
+def synthetic_frame(rows, multi_ratio, seed=0):
+    """Frame of PIDs and doc type lists, multi_ratio with two types."""
+    rng = np.random.default_rng(seed)
+    first = rng.choice(doc_types, rows)
+    second = rng.choice(doc_types, rows)
+    multi = rng.random(rows) < multi_ratio
+    values = [[a, b] if m else [a] for a, b, m in zip(first, second, multi)]
+    return pd.DataFrame({'PID': [f'noaa:{i}' for i in range(rows)],
+        resource: values})
+
+
+def previous_convert(df, resource):
+    """Implementation before the single pass explode."""
+    df[resource] = df[resource].str.join(',')
+    if any(df[resource].str.contains(',')) == True:
+        multi_docs = df[df[resource].str.contains(',')].copy()
+        multi_docs[resource] = multi_docs[resource].str.split(',')
+        one, two = multi_docs.copy(), multi_docs.copy()
+        one[resource] = one[resource].str[0]
+        two[resource] = two[resource].str[1]
+        df = df.drop(index=multi_docs.index)
+        df = pd.concat([df, one, two], ignore_index=True).copy()
+    df[resource] = df[resource].apply(normalize_doc_types)
+    return df
+
+
+def measure(convert, rows, multi_ratio, repeat):
+    best, out_rows = None, 0
+    for i in range(repeat):
+        df = synthetic_frame(rows, multi_ratio)
+        begin = time.perf_counter()
+        out = convert(df, resource)
+        seconds = time.perf_counter() - begin
+        best = seconds if best is None else min(best, seconds)
+        out_rows = len(out)
+    return {'seconds': best, 'rows_out': out_rows}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--multi-ratio', type=float, default=0.15)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = {
+        'previous': measure(previous_convert, args.rows,
+            args.multi_ratio, args.repeat),
+        'current': measure(convert_df_list_to_str, args.rows,
+            args.multi_ratio, args.repeat)
+        }
+    print(json.dumps(results, indent=2))
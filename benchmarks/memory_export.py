@@ -0,0 +1,62 @@
+import os, sys, json, resource, argparse, tempfile
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from api_query import RepositoryQuery, DataExporter
+
+"""
+Peak RSS of the full 'noaa' CSV export, list based vs. streaming.
+
+Each mode runs in its own process so peak RSS isn't shared.
+
+Usage:
+    python benchmarks/memory_export.py [--api-url URL]
+"""
+
+fields = [ 'PID', 'mods.title','mods.type_of_resource',
+    'fgs.createdDate','mods.sm_digital_object_identifier',
+    'mods.related_series','mods.ss_publishyear', 'mods.sm_localcorpname']
+
+
+def peak_rss_mb():
+    """Peak resident set size of current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on linux
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def run_export(api_url, stream, queue):
+    """Export entire IR, putting peak RSS on queue."""
+    q = RepositoryQuery(fields)
+    if api_url:
+        q.api_url = api_url
+
+    with tempfile.TemporaryDirectory() as export_path:
+        DataExporter().export_all_collections_as_csv(q,
+            export_path=export_path, stream=stream)
+
+    queue.put(peak_rss_mb())
+
+
+def measure(api_url, stream):
+    queue = Queue()
+    p = Process(target=run_export, args=(api_url, stream, queue))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--api-url', default=None,
+        help='collection api url, defaults to RepositoryQuery.api_url')
+    args = parser.parse_args()
+
+    results = {
+        'list_peak_rss_mb': measure(args.api_url, stream=False),
+        'stream_peak_rss_mb': measure(args.api_url, stream=True)
+        }
+    print(json.dumps(results, indent=2))
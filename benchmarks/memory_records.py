@@ -0,0 +1,62 @@
+import os, sys, json, time, argparse, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from api_query import field_iterator, field_values
+from records import record_type
+
+"""
+Memory held by a synthetic collection of filtered records,
+dicts (field_iterator) vs. compact Records (filter_on_fields).
+
+Usage:
+    python benchmarks/memory_records.py [--records 500000]
+"""
+
+fields = [ 'PID', 'mods.title','mods.type_of_resource',
+    'fgs.createdDate','mods.sm_digital_object_identifier',
+    'mods.related_series','mods.ss_publishyear', 'mods.sm_localcorpname']
+
+
+def synthetic_docs(n):
+    """Generator of IR documents."""
+    for i in range(n):
+        yield {
+            'PID': f'noaa:{i}',
+            'mods.title': f'Technical memorandum {i}',
+            'mods.type_of_resource': ['text'],
+            'fgs.createdDate': '2020-01-01T00:00:00Z',
+            'mods.sm_digital_object_identifier': [f'10.0000/{i}'],
+            'mods.related_series': 'NOAA technical memorandum',
+            'mods.ss_publishyear': '2020',
+            'mods.sm_localcorpname': ['National Weather Service',
+                'Office of Oceanic and Atmospheric Research'][:1 + i % 2],
+            }
+
+
+def measure(build, n):
+    """Memory retained by built records and time to build them."""
+    tracemalloc.start()
+    begin = time.perf_counter()
+    data = build(synthetic_docs(n))
+    seconds = time.perf_counter() - begin
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return {'seconds': seconds, 'retained_mb': current / 1024 / 1024}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=500000)
+    args = parser.parse_args()
+
+    record = record_type(fields)
+    results = {
+        'dict': measure(
+            lambda docs: [field_iterator(d, fields) for d in docs],
+            args.records),
+        'record': measure(
+            lambda docs: [record(field_values(d, fields)) for d in docs],
+            args.records)
+        }
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,185 @@
+import os, sys, json, time, argparse, resource, tempfile, platform, subprocess
+from datetime import datetime
+from queue import Empty
+import multiprocessing
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+from solr_server import start_server
+
+"""
+Benchmark suite run against a local stand-in of the export API.
+
+Each benchmark runs in its own spawned process, so peak RSS doesn't
+include the stand-in server, and reports wall time, records/sec and
+peak RSS. A benchmark that fails reports its error instead. Results are written as JSON so runs can be
+compared across versions.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--size 20000]
+        [--multivalue-density 0.3] [--output bench_results.json]
+        [--only harvest,export_csv]
+"""
+
+fields = [ 'PID', 'mods.title','mods.type_of_resource',
+    'fgs.createdDate','mods.sm_digital_object_identifier',
+    'mods.related_series','mods.ss_publishyear', 'mods.sm_localcorpname']
+
+
+def peak_rss_mb():
+    """Peak resident set size of current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on linux
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def repository_query(view_url):
+    from api_query import RepositoryQuery
+    q = RepositoryQuery(fields)
+    # as publish_db.new_db and batch.py harvest
+    q.field_projection = True
+    q.api_url = view_url
+    return q
+
+
+def bench_harvest(urls, tmp):
+    q = repository_query(urls['view'])
+    q.get_all_collections_json()
+    return len(q.collection_data)
+
+
+def bench_harvest_stream(urls, tmp):
+    q = repository_query(urls['view'])
+    return sum(1 for doc in q.iter_fields(q.iter_collection_json('noaa')))
+
+
+def bench_export_csv(urls, tmp):
+    from api_query import DataExporter
+    q = repository_query(urls['view'])
+    DataExporter().export_collection_as_csv(q, 'noaa', export_path=tmp,
+        col_fname='noaa.csv', stream=True)
+    with open(os.path.join(tmp, 'noaa.csv'), encoding='utf-8') as fh:
+        return sum(1 for line in fh) - 1
+
+
+def bench_export_parquet(urls, tmp):
+    from api_query import DataExporter
+    q = repository_query(urls['view'])
+    return DataExporter().export_collection_columnar(q, 'noaa',
+        export_path=tmp, fname='noaa.parquet')
+
+
+def bench_facet_count(urls, tmp):
+    from stats import StatsData
+    from api_query import RepositoryQuery
+    pid_info = {name: pid for name, pid in RepositoryQuery.pid_dict.items()
+        if pid != 'noaa'}
+    s = StatsData('mods.sm_localcorpname', pid_info=pid_info)
+    s.baseurl = urls['download']
+    return int(s.facet_count_multiple().sum())
+
+
+def bench_build_db(urls, tmp):
+    import sqlite3
+    from publish_db import build_db
+    q = repository_query(urls['view'])
+    database_path = os.path.join(tmp, 'collections.db')
+    build_db(database_path, q, collection_workers=4)
+    conn = sqlite3.connect(database_path)
+    count = conn.execute('SELECT COUNT(*) FROM all_unique_items').fetchone()[0]
+    conn.close()
+    return count
+
+
+benchmarks = {
+    'harvest': bench_harvest,
+    'harvest_stream': bench_harvest_stream,
+    'export_csv': bench_export_csv,
+    'export_parquet': bench_export_parquet,
+    'facet_count': bench_facet_count,
+    'build_db': bench_build_db
+    }
+
+
+def run_one(name, urls, queue):
+    """Run benchmark name, putting its result on queue."""
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            begin = time.perf_counter()
+            records = benchmarks[name](urls, tmp)
+            seconds = time.perf_counter() - begin
+        except ImportError as e:
+            queue.put({'skipped': str(e)})
+            return
+        except Exception as e:
+            queue.put({'error': repr(e)})
+            return
+        queue.put({
+            'seconds': seconds,
+            'records': records,
+            'records_per_sec': records / seconds if seconds else None,
+            'peak_rss_mb': peak_rss_mb()
+            })
+
+
+def run(name, urls):
+    """Run benchmark name in a fresh spawned process."""
+    # spawn, not fork, so the child doesn't inherit the server's memory
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    p = context.Process(target=run_one, args=(name, urls, queue))
+    p.start()
+    # poll so a child that dies without a result doesn't hang the run
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Empty:
+            if not p.is_alive():
+                result = {'error': f'exited with code {p.exitcode}'}
+                break
+    p.join()
+    return result
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always',
+            '--dirty'], cwd=here, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=20000,
+        help='items in the synthetic noaa collection')
+    parser.add_argument('--multivalue-density', type=float, default=0.3)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--only', default=None,
+        help='comma separated benchmark names')
+    args = parser.parse_args()
+
+    server = start_server(args.size, args.multivalue_density)
+    urls = {'view': server.view_url, 'download': server.download_url}
+
+    names = args.only.split(',') if args.only else list(benchmarks)
+    results = {
+        'version': git_version(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'size': args.size,
+        'multivalue_density': args.multivalue_density,
+        'benchmarks': {}
+        }
+    for name in names:
+        print(f"RUNNING: {name}...")
+        results['benchmarks'][name] = run(name, urls)
+
+    server.shutdown()
+
+    with open(args.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print(json.dumps(results['benchmarks'], indent=2))
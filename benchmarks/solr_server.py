@@ -0,0 +1,148 @@
+import json, time, random, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+"""
+Local stand-in for the NOAA Repository export API.
+
+Serves synthetic collections on the same paths as the real API:
+
+    /fedora/export/view/collection/<pid>
+    /fedora/export/download/collection/<pid>
+
+Both support rows/start paging, fl field lists and from/until windows on
+fgs.createdDate. The 'noaa' collection holds every item; other
+collections hold the items whose RELS_EXT membership lists them.
+"""
+
+collection_pids = ['1', '23702', '3', '4', '5', '6', '7', '8', '9', '11',
+    '12', '10031', '11879', '16402', '22022', '23649', '24914']
+
+corp_names = ['National Weather Service',
+    'Office of Oceanic and Atmospheric Research',
+    'National Marine Fisheries Service', 'National Ocean Service',
+    'United States, National Oceanic and Atmospheric Administration',
+    'Sea Grant', 'Coral Reef Conservation Program']
+
+doc_types = ['text', 'still image', 'cartographic', 'moving image']
+
+
+def synthetic_docs(size, multivalue_density=0.3, seed=0):
+    """
+    Synthetic IR documents.
+
+    Parameters:
+        size: number of items
+        multivalue_density: share of items with more than one
+            corporate name, doc type and collection
+        seed: random seed
+
+    Returns:
+        list of documents.
+    """
+    rng = random.Random(seed)
+    docs = []
+    for i in range(size):
+        multi = rng.random() < multivalue_density
+        n = rng.randint(2, 4) if multi else 1
+        docs.append({
+            'PID': f'noaa:{i}',
+            'mods.title': f'Technical memorandum {i} on '
+                f'{rng.choice(["ocean", "weather", "fisheries", "coral"])}',
+            'mods.type_of_resource': rng.sample(doc_types, min(n, 2)),
+            'fgs.createdDate': f'20{10 + i % 14}-{1 + i % 12:02d}-'
+                f'{1 + i % 28:02d}T00:00:00Z',
+            'mods.sm_digital_object_identifier': [f'10.0000/noaa.{i}'],
+            'mods.related_series': 'NOAA technical memorandum',
+            'mods.ss_publishyear': str(2010 + i % 14),
+            'mods.sm_localcorpname': rng.sample(corp_names, n),
+            'mods.abstract': 'Abstract text. ' * rng.randint(5, 40),
+            'RELS_EXT_isMemberOfCollection_uri_ms': [
+                f'info:fedora/noaa:{pid}'
+                for pid in rng.sample(collection_pids, n)],
+            })
+    return docs
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.rstrip('/').split('/')
+
+        if len(parts) < 2 or parts[-2] != 'collection':
+            self.send_error(404)
+            return
+
+        docs = self.server.collections.get(parts[-1])
+        if docs is None:
+            self.send_error(404)
+            return
+
+        if 'from' in query or 'until' in query:
+            start_d = query.get('from', [''])[0]
+            until_d = query.get('until', ['9999'])[0]
+            docs = [d for d in docs
+                if start_d <= d['fgs.createdDate'] < until_d]
+
+        if self.server.latency:
+            time.sleep(random.uniform(0, self.server.latency))
+
+        # like the real API, an unpaged request returns every item
+        start = int(query.get('start', ['0'])[0])
+        rows = int(query.get('rows', [str(len(docs))])[0])
+        page = docs[start:start + rows]
+
+        if 'fl' in query:
+            fields = query['fl'][0].split(',')
+            page = [{f: d[f] for f in fields if f in d} for d in page]
+
+        body = json.dumps({
+            'responseHeader': {'status': 0},
+            'response': {'numFound': len(docs), 'start': start, 'docs': page}
+            }).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(size=20000, multivalue_density=0.3, port=0, latency=0):
+    """
+    Start stand-in server on a background thread.
+
+    Parameters:
+        size: number of items in the 'noaa' collection
+        multivalue_density: share of items with multiple values
+        port: port to listen on, any free port if 0
+        latency: max random seconds each response is delayed, so
+            concurrent pages complete out of order
+
+    Returns:
+        server. server.view_url and server.download_url are the
+        collection urls to use as api_url / baseurl.
+    """
+    docs = synthetic_docs(size, multivalue_density)
+    collections = {'noaa': docs}
+    for pid in collection_pids:
+        member = f'info:fedora/noaa:{pid}'
+        collections[pid] = [d for d in docs
+            if member in d['RELS_EXT_isMemberOfCollection_uri_ms']]
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.collections = collections
+    server.latency = latency
+
+    base = f'http://127.0.0.1:{server.server_address[1]}/fedora/export'
+    server.view_url = f'{base}/view/collection/'
+    server.download_url = f'{base}/download/collection/'
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,206 @@
+import time, random, threading
+from urllib.parse import urlsplit
+from contextlib import nullcontext
+import requests
+from requests.adapters import HTTPAdapter
+from response_cache import ResponseCache, entry_to_response
+
+"""
+Shared HTTP session used by api_query.py, stats.py and publish_db.py.
+
+Requests made through a single session reuse pooled keep-alive
+connections instead of opening a new connection per request.
+"""
+
+
+class Session():
+    """Pooled keep-alive session used to query the NOAA Repository."""
+
+    headers = {'Accept-Encoding': 'gzip, deflate'}
+
+    # status codes worth retrying
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_size=10, cache=None, retries=3, backoff=1.0,
+        host_limit=None):
+        self.pool_size = pool_size
+        # optional response_cache.ResponseCache
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        # max requests in flight per host across all threads,
+        # unlimited if None
+        self.host_limit = host_limit
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+
+        # one adapter for both schemes so pool sizing applies to each
+        self.adapter = HTTPAdapter(pool_connections=pool_size,
+            pool_maxsize=pool_size)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+
+    def get(self, url, params=None, **kwargs):
+        """
+        Make GET request using pooled connections.
+
+        If a cache is set, fresh entries are returned without a
+        request and stale entries are revalidated with
+        If-None-Match/If-Modified-Since when possible.
+
+        Parameters:
+            url: url string
+            params: query params
+            kwargs: passed along to requests.Session.get
+
+        Returns:
+            requests response object.
+        """
+        if self.cache is None:
+            return self.request(url, params=params, **kwargs)
+
+        key = self.cache.key(url, params)
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry_to_response(entry)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        r = self.request(url, params=params, headers=headers, **kwargs)
+
+        if r.status_code == 304 and entry is not None:
+            self.cache.refresh(key)
+            return entry_to_response(entry)
+        if r.status_code == 200:
+            self.cache.set(key, r)
+        return r
+
+
+    def request(self, url, **kwargs):
+        """
+        GET request retried on connection errors and retry_statuses.
+
+        Waits a random time up to backoff * 2 ** attempt between
+        attempts (exponential backoff with full jitter).
+
+        Parameters:
+            url: url string
+            kwargs: passed along to requests.Session.get
+
+        Returns:
+            requests response object. Last response is returned if
+            retries are exhausted on a retryable status code.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.host_semaphore(url):
+                    r = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            else:
+                if r.status_code not in self.retry_statuses or \
+                    attempt == self.retries:
+                    return r
+
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+
+    def host_semaphore(self, url):
+        """
+        Semaphore limiting requests in flight to url's host.
+
+        Returns:
+            threading.BoundedSemaphore, or a no-op context
+            manager if host_limit is None.
+        """
+        if self.host_limit is None:
+            return nullcontext()
+
+        host = urlsplit(url).netloc
+        with self.lock:
+            semaphore = self.host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.host_limit)
+                self.host_semaphores[host] = semaphore
+        return semaphore
+
+
+    def connection_stats(self):
+        """
+        Counts connections opened vs. reused across all host pools.
+
+        Returns:
+            dict with opened, reused and requests counts.
+        """
+
+        opened, total = 0, 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            opened += pool.num_connections
+            total += pool.num_requests
+
+        return {
+            'opened': opened,
+            'reused': total - opened,
+            'requests': total
+            }
+
+
+    def close(self):
+        """Close session along with all pooled connections."""
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+_session = None
+
+
+def get_session():
+    """
+    Returns shared Session, creating it on first use.
+    """
+    global _session
+    if _session is None:
+        _session = Session()
+    return _session
+
+
+def configure_session(pool_size=10, cache_dir=None, ttl=86400,
+    max_size=1024 * 1024 * 1024, retries=3, backoff=1.0, host_limit=None):
+    """
+    Replace shared Session with one using a new pool size.
+
+    Parameters:
+        pool_size: max number of connections kept open per host.
+        cache_dir: directory for on-disk response cache. No
+            caching if None.
+        ttl: seconds a cached response is used without revalidation
+        max_size: max cache size in bytes before LRU eviction
+        retries: times a failed request is retried
+        backoff: base seconds for exponential backoff between retries
+        host_limit: max requests in flight per host, unlimited if None
+
+    Returns:
+        new shared Session.
+    """
+    global _session
+    if _session is not None:
+        _session.close()
+
+    cache = None
+    if cache_dir is not None:
+        cache = ResponseCache(cache_dir, ttl, max_size)
+
+    _session = Session(pool_size, cache, retries, backoff, host_limit)
+    return _session
@@ -0,0 +1,110 @@
+import io, json
+
+# optional faster parsers, stdlib json is used if not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+"""
+Decoding of NOAA Repository API page responses.
+
+orjson is used to decode whole pages when installed. When only
+some fields are needed and ijson is installed, the response.docs
+array is parsed incrementally and values of other fields are never
+turned into Python objects. This lowers peak memory per page at
+some cost in decode time; see benchmarks/bench_json_decode.py.
+"""
+
+scalar_events = ('string', 'number', 'boolean', 'null')
+
+
+def loads(content):
+    """
+    Decode JSON bytes, using orjson if available.
+
+    Parameters:
+        content: JSON bytes or string
+
+    Returns:
+        decoded JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def decode_docs(content, fields=None):
+    """
+    Decode docs from an API page response body.
+
+    Parameters:
+        content: response body bytes, i.e. requests response.content
+        fields: document fields to keep. All fields kept if None.
+
+    Returns:
+        list of documents.
+    """
+    if fields is not None and ijson is not None:
+        return parse_docs(content, fields)
+
+    docs = loads(content)['response']['docs']
+    if fields is None:
+        return docs
+
+    return [{f: doc[f] for f in fields if f in doc} for doc in docs]
+
+
+def parse_docs(content, fields):
+    """
+    Incrementally parse response.docs, only building values
+    for requested fields.
+
+    Parameters:
+        content: response body bytes
+        fields: document fields to keep
+
+    Returns:
+        list of documents.
+    """
+    fields = set(fields)
+    item = 'response.docs.item'
+
+    docs, doc, key, base = [], None, None, None
+
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    for prefix, event, value in ijson.parse(io.BytesIO(content),
+        use_float=True):
+
+        if prefix == item:
+            if event == 'start_map':
+                doc = {}
+            elif event == 'end_map':
+                docs.append(doc)
+                doc = None
+            elif event == 'map_key':
+                # track key by event rather than prefix, since
+                # field names contain dots i.e. 'mods.title'
+                key = value if value in fields else None
+                base = f'{item}.{key}'
+            continue
+
+        if doc is None or key is None:
+            continue
+
+        if prefix == base:
+            if event == 'start_array':
+                doc[key] = []
+            elif event in scalar_events:
+                doc[key] = value
+        elif prefix == base + '.item' and event in scalar_events:
+            doc[key].append(value)
+
+    return docs
@@ -1,6 +1,7 @@
 import os, sys, csv, json
 from datetime import datetime
 from api_query import RepositoryQuery, DataExporter
+from http_session import configure_session
 
 """ 
 Menu provides interactive command-line menu for api_query.py 
@@ -100,8 +101,7 @@ Query NOAA Resposistory JSON REST API
         filter_by_date(self.query.date_filter)
 
         # export all collections
-        self.export.export_all_collections_as_csv(self.query,
-            self.query.get_all_collections_json())
+        self.export.export_all_collections_as_csv(self.query, stream=True)
 
         clear_screen()
         print('')
@@ -188,5 +188,11 @@ if __name__ == "__main__":
     default_fields =  ['PID', 'mods.title','mods.type_of_resource',
     'fgs.createdDate','mods.sm_digital_object_identifier',
     'mods.related_series']
+    # opt in to caching responses, so repeated menu actions don't
+    # re-fetch, with --cache-dir DIR
+    cache_dir = None
+    if '--cache-dir' in sys.argv[1:-1]:
+        cache_dir = sys.argv[sys.argv.index('--cache-dir') + 1]
+    configure_session(cache_dir=cache_dir)
     m = Menu()
     m.run()
\ No newline at end of file
@@ -0,0 +1,315 @@
+import time, json, threading
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+"""
+Timing and throughput instrumentation used by api_query.py,
+stats.py and publish_db.py.
+
+Stage timers, counters and latency histograms are kept in a Metrics
+instance and exported as a JSON report or Prometheus text. A disabled
+Metrics, the default, does no work beyond a method call.
+"""
+
+
+class Metrics():
+    """Per-stage timers, counters, histograms and progress."""
+
+    # upper bounds of latency histogram buckets, in seconds
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    # Prometheus metric name prefix
+    prefix = 'noaa_ir'
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        """Clear all recorded values."""
+        # stage: [seconds, calls]
+        self.stages = {}
+        # name: value, i.e. bytes, records
+        self.counters = {}
+        # name: [bucket counts, sum, count]
+        self.histograms = {}
+        # name: [start time, done, total]
+        self.progresses = {}
+        self.started = time.time()
+
+
+    def stage(self, name):
+        """
+        Context manager timing a stage. Time is summed over every
+        call, including calls made from different threads.
+
+        Parameters:
+            name: stage name, i.e. 'decode'
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._time_stage(name)
+
+
+    @contextmanager
+    def _time_stage(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - begin
+            with self.lock:
+                stage = self.stages.setdefault(name, [0.0, 0])
+                stage[0] += seconds
+                stage[1] += 1
+
+
+    def add(self, name, value=1):
+        """
+        Add value to counter name.
+
+        Parameters:
+            name: counter name, i.e. 'bytes'
+            value: amount added
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def observe(self, name, seconds):
+        """
+        Record a latency in histogram name.
+
+        Parameters:
+            name: histogram name, i.e. 'request_seconds'
+            seconds: observed latency
+        """
+        if not self.enabled:
+            return
+        i = bisect_left(self.buckets, seconds)
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.histograms[name] = histogram
+            histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+
+    def request(self, seconds, size):
+        """
+        Record one HTTP request: latency in request_seconds,
+        plus requests and bytes counters. Used by every request
+        path so they're recorded the same way.
+
+        Parameters:
+            seconds: request latency
+            size: response body bytes
+        """
+        if not self.enabled:
+            return
+        self.observe('request_seconds', seconds)
+        self.add('requests')
+        self.add('bytes', size)
+
+
+    def progress(self, name, done, total=None):
+        """
+        Update progress of name. Rate is measured from the
+        first update, or the last update with done 0.
+
+        Parameters:
+            name: progress name, i.e. 'harvest_noaa'
+            done: records done so far
+            total: records expected, if known
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            progress = self.progresses.get(name)
+            if progress is None or done == 0:
+                progress = [time.perf_counter(), 0, None]
+                self.progresses[name] = progress
+            progress[1] = done
+            if total is not None:
+                progress[2] = total
+
+
+    def track(self, name, records, total=None, every=1000):
+        """
+        Count records passing through an iterable as progress
+        of name.
+
+        Parameters:
+            name: progress name
+            records: iterable, i.e. iter_collection_json
+            total: records expected, if known
+            every: records between progress updates
+
+        Returns:
+            generator of records, or records unchanged if disabled.
+        """
+        if not self.enabled:
+            return records
+        return self._track(name, records, total, every)
+
+
+    def _track(self, name, records, total, every):
+        done = 0
+        self.progress(name, done, total)
+        for record in records:
+            yield record
+            done += 1
+            if done % every == 0:
+                self.progress(name, done)
+        self.progress(name, done)
+
+
+    def rates(self):
+        """
+        Returns:
+            dict of progress name: dict of done, total,
+            records_per_sec and eta_seconds.
+        """
+        now = time.perf_counter()
+        rates = {}
+        with self.lock:
+            for name, (start, done, total) in self.progresses.items():
+                elapsed = now - start
+                rate = done / elapsed if elapsed > 0 else 0.0
+                eta = None
+                if total is not None and rate > 0:
+                    eta = max(total - done, 0) / rate
+                rates[name] = {
+                    'done': done,
+                    'total': total,
+                    'records_per_sec': rate,
+                    'eta_seconds': eta
+                    }
+        return rates
+
+
+    def report(self):
+        """
+        Returns:
+            dict of everything recorded, as written by to_json.
+        """
+        rates = self.rates()
+        with self.lock:
+            return {
+                'started': self.started,
+                'elapsed_seconds': time.time() - self.started,
+                'stages': {name: {'seconds': seconds, 'calls': calls}
+                    for name, (seconds, calls) in self.stages.items()},
+                'counters': dict(self.counters),
+                'histograms': {name: {
+                    'buckets': dict(zip([str(b) for b in self.buckets]
+                        + ['+Inf'], counts)),
+                    'sum': total, 'count': count}
+                    for name, (counts, total, count)
+                    in self.histograms.items()},
+                'progress': rates
+                }
+
+
+    def to_json(self, file_path):
+        """
+        Write report to a JSON file.
+
+        Parameters:
+            file_path: JSON file path
+        """
+        with open(file_path, 'w', encoding='utf-8') as fh:
+            json.dump(self.report(), fh, indent=2)
+
+
+    def to_prometheus(self):
+        """
+        Report in Prometheus text exposition format.
+
+        Returns:
+            string of metrics.
+        """
+        report = self.report()
+        p = self.prefix
+        lines = []
+
+        lines.append(f'# TYPE {p}_stage_seconds_total counter')
+        for name, stage in report['stages'].items():
+            lines.append(f'{p}_stage_seconds_total{{stage="{name}"}} '
+                f'{stage["seconds"]}')
+        lines.append(f'# TYPE {p}_stage_calls_total counter')
+        for name, stage in report['stages'].items():
+            lines.append(f'{p}_stage_calls_total{{stage="{name}"}} '
+                f'{stage["calls"]}')
+
+        for name, value in report['counters'].items():
+            lines.append(f'# TYPE {p}_{name}_total counter')
+            lines.append(f'{p}_{name}_total {value}')
+
+        for name, histogram in report['histograms'].items():
+            lines.append(f'# TYPE {p}_{name} histogram')
+            cumulative = 0
+            for le, count in histogram['buckets'].items():
+                cumulative += count
+                lines.append(f'{p}_{name}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f'{p}_{name}_sum {histogram["sum"]}')
+            lines.append(f'{p}_{name}_count {histogram["count"]}')
+
+        lines.append(f'# TYPE {p}_records_per_second gauge')
+        for name, rate in report['progress'].items():
+            lines.append(f'{p}_records_per_second{{progress="{name}"}} '
+                f'{rate["records_per_sec"]}')
+        lines.append(f'# TYPE {p}_eta_seconds gauge')
+        for name, rate in report['progress'].items():
+            if rate['eta_seconds'] is not None:
+                lines.append(f'{p}_eta_seconds{{progress="{name}"}} '
+                    f'{rate["eta_seconds"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    def to_prometheus_file(self, file_path):
+        """
+        Write Prometheus text to file_path, i.e. for the node
+        exporter textfile collector.
+
+        Parameters:
+            file_path: .prom file path
+        """
+        with open(file_path, 'w', encoding='utf-8') as fh:
+            fh.write(self.to_prometheus())
+
+
+_metrics = None
+
+
+def get_metrics():
+    """
+    Returns shared Metrics, disabled until configure_metrics
+    is called.
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics(enabled=False)
+    return _metrics
+
+
+def configure_metrics(enabled=True):
+    """
+    Replace shared Metrics.
+
+    Parameters:
+        enabled: record metrics
+
+    Returns:
+        new shared Metrics.
+    """
+    global _metrics
+    _metrics = Metrics(enabled)
+    return _metrics
@@ -1,9 +1,10 @@
-import os, json, subprocess, re, sys, shutil
-import pandas as pd
-from glob import glob
+import os, json, subprocess, re, sys, shutil, sqlite3, queue, threading, hashlib
+from itertools import islice
 from datetime import datetime
-import requests
-from api_query import RepositoryQuery, DataExporter
+from api_query import RepositoryQuery, field_values, collection_memberships
+from http_session import configure_session
+from scheduler import run_collections
+from metrics import Metrics
 
 
 """
@@ -54,64 +55,562 @@ def write_metadata_json(database, repository_query):
         json.dump(meta, f, indent=2)
 
 
-def new_db(ir_fields, app_name):
+def quote(name):
+    """Quote SQLite identifier, i.e. 'mods.title' column."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def create_table(conn, table, fields):
+    """
+    Create table with a TEXT column for each field.
+
+    Parameters:
+        conn: sqlite3 connection
+        table: table name
+        fields: list of column names
+    """
+    columns = ', '.join(f'{quote(f)} TEXT' for f in fields)
+    conn.execute(f'DROP TABLE IF EXISTS {quote(table)}')
+    conn.execute(f'CREATE TABLE {quote(table)} ({columns})')
+
+
+def insert_records(conn, table, fields, records, batch_size=5000):
+    """
+    Bulk insert records using batched executemany, one
+    transaction per batch.
+
+    Parameters:
+        conn: sqlite3 connection
+        table: table name
+        fields: list of column names
+        records: iterable of dicts, i.e. RepositoryQuery.iter_fields
+        batch_size: rows per executemany call
+
+    Returns:
+        number of rows inserted.
+    """
+    placeholders = ', '.join('?' for f in fields)
+    sql = f'INSERT INTO {quote(table)} VALUES ({placeholders})'
+
+    rows = ([record.get(f, '') for f in fields] for record in records)
+    total = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        with conn:
+            conn.executemany(sql, batch)
+        total += len(batch)
+    return total
+
+
+def load_single_pass(conn, repository_query, tables, batch_size=5000,
+    membership_field='RELS_EXT_isMemberOfCollection_uri_ms'):
+    """
+    Load every collection table from one harvest of the entire IR.
+
+    Each item is written to the 'noaa' collection table and to the
+    table of every collection it is a member of, read from
+    membership_field.
+
+    Parameters:
+        conn: sqlite3 connection
+        repository_query: RepositoryQuery class instance
+        tables: dict of collection pid: table name. Tables
+            must already exist.
+        batch_size: rows per executemany call
+        membership_field: document field listing parent collections
+    """
+    fields = repository_query.fields
+    placeholders = ', '.join('?' for f in fields)
+    batches = {pid: [] for pid in tables}
+
+    def flush(pid):
+        sql = f'INSERT INTO {quote(tables[pid])} VALUES ({placeholders})'
+        with conn:
+            conn.executemany(sql, batches[pid])
+        batches[pid] = []
+
+    docs = repository_query.iter_collection_json('noaa', [membership_field])
+    for doc in docs:
+        row = field_values(doc, fields)
+
+        pids = collection_memberships(doc, membership_field)
+        pids.add('noaa')
+        for pid in pids:
+            if pid not in batches:
+                continue
+            batches[pid].append(row)
+            if len(batches[pid]) >= batch_size:
+                flush(pid)
+
+    for pid in batches:
+        if batches[pid]:
+            flush(pid)
+
+
+def load_concurrent(conn, repository_query, tables, batch_size=5000,
+    max_workers=4):
+    """
+    Load collection tables, harvesting up to max_workers
+    collections at once.
+
+    Worker threads put batches of rows on a bounded queue as pages
+    arrive; this thread, which owns the sqlite connection, inserts
+    them. Build time is then bounded by the largest collection
+    rather than the sum of all of them. If an insert fails, workers
+    are cancelled and the queue drained before the error is raised.
+
+    Parameters:
+        conn: sqlite3 connection
+        repository_query: RepositoryQuery class instance
+        tables: dict of collection pid: table name. Tables
+            must already exist.
+        batch_size: rows per executemany call
+        max_workers: max number of collections harvested at once
+    """
+    fields = repository_query.fields
+    placeholders = ', '.join('?' for f in fields)
+    batches = queue.Queue(maxsize=max_workers * 2)
+    cancel = threading.Event()
+
+    def harvest(pid):
+        if cancel.is_set():
+            return
+        records = repository_query.iter_fields(
+            repository_query.iter_collection_json(pid))
+        rows = ([record.get(f, '') for f in fields] for record in records)
+        while not cancel.is_set():
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            # timeout so a cancelled worker isn't blocked on a full queue
+            while not cancel.is_set():
+                try:
+                    batches.put((pid, batch), timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+    def produce():
+        try:
+            for pid, result in run_collections(harvest, tables, max_workers):
+                if not cancel.is_set():
+                    print(f"WRITTEN: {tables[pid]} to DB")
+        except Exception as e:
+            batches.put(e)
+        finally:
+            batches.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    error = None
+    done = False
+    try:
+        while True:
+            item = batches.get()
+            if item is None:
+                done = True
+                break
+            if isinstance(item, Exception):
+                error = item
+                continue
+
+            pid, batch = item
+            with conn:
+                conn.executemany(f'INSERT INTO {quote(tables[pid])} '
+                    f'VALUES ({placeholders})', batch)
+    finally:
+        # if an insert failed, stop workers and drain until they
+        # finish, so none are left blocked on put
+        cancel.set()
+        while not done:
+            done = batches.get() is None
+
+    if error is not None:
+        raise error
+
+
+def create_indexes(conn, table, fields, fts_fields):
+    """
+    Create PID index and FTS table once table is loaded.
+
+    FTS table is an external content FTS5 table named <table>_fts,
+    which datasette picks up for full text search. Triggers keep it
+    in sync with later inserts, updates and deletes.
+
+    Parameters:
+        conn: sqlite3 connection
+        table: table name
+        fields: list of column names
+        fts_fields: columns to full text index
+    """
+    with conn:
+        if 'PID' in fields:
+            conn.execute(f'CREATE INDEX {quote(table + "_pid")} '
+                f'ON {quote(table)} ("PID")')
+
+        fts_fields = [f for f in fts_fields if f in fields]
+        if fts_fields:
+            fts = quote(table + '_fts')
+            columns = ', '.join(quote(f) for f in fts_fields)
+            conn.execute(f'CREATE VIRTUAL TABLE {fts} USING fts5('
+                f'{columns}, content={quote(table)})')
+            conn.execute(f'INSERT INTO {fts} (rowid, {columns}) '
+                f'SELECT rowid, {columns} FROM {quote(table)}')
+            create_fts_triggers(conn, table, fts_fields)
+
+
+def create_fts_triggers(conn, table, fts_fields):
+    """
+    Create triggers keeping <table>_fts in sync with table,
+    if they don't exist yet.
+
+    Parameters:
+        conn: sqlite3 connection
+        table: table name
+        fts_fields: columns in the FTS table
+    """
+    fts = quote(table + '_fts')
+    columns = ', '.join(quote(f) for f in fts_fields)
+    new = ', '.join('new.' + quote(f) for f in fts_fields)
+    old = ', '.join('old.' + quote(f) for f in fts_fields)
+
+    delete = (f'INSERT INTO {fts} ({fts}, rowid, {columns}) '
+        f"VALUES ('delete', old.rowid, {old});")
+    insert = f'INSERT INTO {fts} (rowid, {columns}) VALUES (new.rowid, {new});'
+
+    for suffix, event, body in (('_ai', 'INSERT', insert),
+        ('_ad', 'DELETE', delete), ('_au', 'UPDATE', delete + insert)):
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {quote(table + suffix)} '
+            f'AFTER {event} ON {quote(table)} BEGIN {body} END')
+
+
+def build_db(database_path, repository_query, fts_fields=('mods.title',
+    'mods.type_of_resource'), batch_size=5000, single_pass=False,
+    collection_workers=1, metrics=None):
+    """
+    Build SQLite database with a table per collection and a
+    table of all unique items.
+
+    Records are streamed from the API straight into SQLite. Journaling
+    and syncing are relaxed during the load, then indexes and FTS
+    tables are built once all rows are in.
+
+    Parameters:
+        database_path: sqlite database file path
+        repository_query: RepositoryQuery class instance
+        fts_fields: columns to full text index
+        batch_size: rows per executemany call
+        single_pass: harvest entire IR once and derive collection
+            tables from item memberships instead of querying
+            each collection.
+        collection_workers: max number of collections harvested
+            at once when not single_pass.
+        metrics: metrics.Metrics stage timings are recorded in.
+            Defaults to repository_query metrics.
+    """
+    metrics = metrics or repository_query.metrics
+    fields = repository_query.fields
+    conn = sqlite3.connect(database_path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+
+    tables = {}
+    for name, pid in repository_query.pid_dict.items():
+        tables[pid] = normalize_names(name)
+        create_table(conn, tables[pid], fields)
+
+    # load time includes harvesting, which is streamed into inserts
+    with metrics.stage('load'):
+        if not single_pass:
+            # count every collection up front in one concurrent batch
+            repository_query.get_row_totals(tables)
+
+        try:
+            if single_pass:
+                print("WRITING: all collections to DB...")
+                load_single_pass(conn, repository_query, tables, batch_size)
+            elif collection_workers > 1:
+                load_concurrent(conn, repository_query, tables, batch_size,
+                    collection_workers)
+            else:
+                for pid, table in tables.items():
+                    print(f"WRITING: {table} to DB...")
+                    records = repository_query.iter_fields(
+                        repository_query.iter_collection_json(pid))
+                    insert_records(conn, table, fields, records, batch_size)
+        finally:
+            # totals left by a failed harvest would be stale next run
+            repository_query.row_totals.clear()
+
+    tables = list(tables.values())
+
+    # unique items across every collection table
+    with metrics.stage('union'):
+        create_table(conn, 'all_unique_items', fields)
+        union = ' UNION '.join(f'SELECT * FROM {quote(t)}' for t in tables)
+        with conn:
+            conn.execute(f'INSERT INTO all_unique_items {union}')
+    tables.append('all_unique_items')
+
+    with metrics.stage('index'):
+        for table in tables:
+            create_indexes(conn, table, fields, fts_fields)
+
+    # back to defaults for the published database
+    conn.execute('PRAGMA synchronous = FULL')
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.close()
+
+
+def row_digest(row):
+    """8 byte digest of a row's exported field values."""
+    key = '\x1f'.join(str(value) for value in row)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+
+
+def update_table(conn, table, fields, records):
+    """
+    Update table in place to match records, keyed on PID.
+
+    Rows are compared by a digest of their field values, so only
+    new, changed and removed rows are written, in a single
+    transaction. FTS tables are kept in sync by their triggers.
+
+    Parameters:
+        conn: sqlite3 connection
+        table: table name
+        fields: list of column names, including PID
+        records: iterable of dicts, i.e. RepositoryQuery.iter_fields
+
+    Returns:
+        dict of inserted, updated and deleted row counts.
+    """
+    columns = ', '.join(quote(f) for f in fields)
+    pid_index = fields.index('PID')
+
+    # PID: (rowid, digest) of rows already in table
+    existing, deletes = {}, []
+    for row in conn.execute(f'SELECT rowid, {columns} FROM {quote(table)}'):
+        pid = row[1 + pid_index]
+        if pid in existing:
+            deletes.append((row[0],))
+        else:
+            existing[pid] = (row[0], row_digest(row[1:]))
+
+    inserts, updates, seen = [], [], set()
+    for record in records:
+        row = [record.get(f, '') for f in fields]
+        pid = row[pid_index]
+        if pid in seen:
+            continue
+        seen.add(pid)
+
+        old = existing.get(pid)
+        if old is None:
+            inserts.append(row)
+        elif old[1] != row_digest(row):
+            updates.append(row + [old[0]])
+
+    deletes += [(rowid,) for pid, (rowid, digest) in existing.items()
+        if pid not in seen]
+
+    placeholders = ', '.join('?' for f in fields)
+    assignments = ', '.join(f'{quote(f)} = ?' for f in fields)
+    with conn:
+        conn.executemany(f'DELETE FROM {quote(table)} WHERE rowid = ?',
+            deletes)
+        conn.executemany(f'UPDATE {quote(table)} SET {assignments} '
+            f'WHERE rowid = ?', updates)
+        conn.executemany(f'INSERT INTO {quote(table)} '
+            f'VALUES ({placeholders})', inserts)
+
+    return {'inserted': len(inserts), 'updated': len(updates),
+        'deleted': len(deletes)}
+
+
+def update_db(database_path, repository_query, fts_fields=('mods.title',
+    'mods.type_of_resource'), collection_workers=1, metrics=None):
+    """
+    Update a database built by build_db in place, applying only
+    inserts, updates and deletes to each table.
+
+    Parameters:
+        database_path: sqlite database file path
+        repository_query: RepositoryQuery class instance
+        fts_fields: columns to full text index
+        collection_workers: max number of collections harvested
+            at once. Harvested records of collections in flight
+            are held in memory until their table is updated.
+        metrics: metrics.Metrics stage timings are recorded in.
+            Defaults to repository_query metrics.
+
+    Returns:
+        True if updated, False if the database's columns don't
+        match repository_query fields, in which case nothing
+        is changed and the database needs a full build.
+    """
+    metrics = metrics or repository_query.metrics
+    fields = list(repository_query.fields)
+    conn = sqlite3.connect(database_path)
+
+    tables = {pid: normalize_names(name)
+        for name, pid in repository_query.pid_dict.items()}
+
+    for table in list(tables.values()) + ['all_unique_items']:
+        columns = [row[1] for row in
+            conn.execute(f'PRAGMA table_info({quote(table)})')]
+        if columns and columns != fields:
+            conn.close()
+            return False
+
+        if not columns:
+            # collection added since the last build
+            create_table(conn, table, fields)
+            create_indexes(conn, table, fields, fts_fields)
+        else:
+            fts = [f for f in fts_fields if f in fields]
+            fts_exists = conn.execute('SELECT 1 FROM sqlite_master '
+                'WHERE name = ?', (table + '_fts',)).fetchone()
+            if fts and fts_exists:
+                with conn:
+                    create_fts_triggers(conn, table, fts)
+
+    def apply(table, records):
+        with metrics.stage('update'):
+            counts = update_table(conn, table, fields, records)
+        for key, count in counts.items():
+            metrics.add(f'rows_{key}', count)
+        print(f"UPDATED: {table} {counts}")
+
+    repository_query.get_row_totals(tables)
+
+    try:
+        if collection_workers > 1:
+            harvest = lambda pid: list(repository_query.iter_fields(
+                repository_query.iter_collection_json(pid)))
+            for pid, records in run_collections(harvest, tables,
+                collection_workers):
+                apply(tables[pid], records)
+        else:
+            for pid, table in tables.items():
+                apply(table, repository_query.iter_fields(
+                    repository_query.iter_collection_json(pid)))
+    finally:
+        # totals left by a failed harvest would be stale next run
+        repository_query.row_totals.clear()
+
+    # unique items across every collection table
+    union = ' UNION '.join(f'SELECT * FROM {quote(t)}'
+        for t in tables.values())
+    rows = conn.execute(union).fetchall()
+    apply('all_unique_items', (dict(zip(fields, row)) for row in rows))
+
+    conn.close()
+    return True
+
+
+def latest_database(data_dir):
+    """
+    Most recently modified collections database in data_dir.
+
+    Returns:
+        file path, None if there isn't one.
+    """
+    if os.path.exists(data_dir) == False:
+        return None
+
+    paths = [os.path.join(data_dir, f) for f in os.listdir(data_dir)
+        if f.startswith('collections-') and f.endswith('.db')]
+    if not paths:
+        return None
+    return max(paths, key=os.path.getmtime)
+
+
+def new_db(ir_fields, app_name, pool_size=10, cache_dir=None,
+    single_pass=False, collection_workers=4, host_limit=8,
+    metrics_file=None, incremental=False):
 
     # WARNING: before before changing this dir!!
     # moving it can cause you to delete files!!
     data_dir = 'output'
 
-    # remove dir along with all files
-    if os.path.exists(data_dir):
-        shutil.rmtree(data_dir)
-    os.mkdir(data_dir)
-    
     # create database name
     database = "collections-" + datetime.now().strftime('%m-%d-%Y') + '.db'
 
     # create database path
     database_path = os.path.join(data_dir, database)
 
+    # with incremental, a copy of the last database is updated.
+    # Otherwise, or if there isn't one, it is rebuilt
+    previous = latest_database(data_dir) if incremental else None
+
+    if previous is None:
+        # remove dir along with all files
+        if os.path.exists(data_dir):
+            shutil.rmtree(data_dir)
+        os.mkdir(data_dir)
+
+    # tables are written to a working copy, which only replaces
+    # the published database once every table has succeeded
+    working_path = database_path + '.tmp'
+    if os.path.exists(working_path):
+        os.remove(working_path)
+
+    # single pooled session reused for every collection
+    session = configure_session(pool_size, cache_dir,
+        host_limit=host_limit)
+
+    # stage timings are written to metrics_file as JSON, and
+    # alongside as Prometheus text with a .prom extension
+    metrics = Metrics(enabled=metrics_file is not None)
+
     # donwload ir_data
-    q = RepositoryQuery(ir_fields)
-    de = DataExporter()
+    q = RepositoryQuery(ir_fields, session=session, metrics=metrics)
+    # tables only hold ir_fields, so request only those
+    q.field_projection = True
 
     write_metadata_json(database, q)
 
-    collection_info = q.pid_dict
-    for name, pid in collection_info.items():
-        name = normalize_names(name) + '.csv'
+    try:
+        updated = False
+        if previous is not None:
+            shutil.copyfile(previous, working_path)
+            # one collection at a time, so each is streamed
+            # into its table rather than held in memory
+            updated = update_db(working_path, q, collection_workers=1)
 
-        # query each collection individually,
-        # add to collection data dir
-        de.export_collection_as_csv(
-            q,
-            pid,
-            export_path=data_dir,
-            col_fname=name)
+        if not updated:
+            # fields changed since last build, rebuild from scratch
+            if os.path.exists(working_path):
+                os.remove(working_path)
 
-    # locate all csv files in collection_data/
-    csv_files = glob(os.path.join(data_dir,'*.csv'))
+            # stream each collection into sqlite db
+            build_db(working_path, q, single_pass=single_pass,
+                collection_workers=collection_workers)
+    except Exception:
+        if os.path.exists(working_path):
+            os.remove(working_path)
+        raise
 
-    # concat all csvs into new csv
-    all_items= pd.concat([pd.read_csv(f, sep='\t',
-        quoting=3) for f in csv_files], sort=False)
-    
-    all_items = all_items.drop_duplicates()
-    all_items.to_csv(
-        os.path.join(data_dir,"all_unique_items.csv"),
-        sep='\t',
-        index=False,
-        encoding='utf-8')
-
-    # create sqlite db and populate w/ csvs with FTS on title and document_type
-    for csv in glob(os.path.join(data_dir,'*.csv')):
-        print(f"WRITING: {csv} to DB...")
-        subprocess.call(f"csvs-to-sqlite {csv} {database_path} -s $'\t' -q 3" ,
-        shell=True)
+    os.replace(working_path, database_path)
+    for f in os.listdir(data_dir):
+        if f.startswith('collections-') and f.endswith('.db') \
+            and f != database:
+            os.remove(os.path.join(data_dir, f))
+
+    print(f"CONNECTIONS: {session.connection_stats()}")
 
     # publish heroku app
-    subprocess.call(f'datasette publish heroku {database_path} \
-        --name {app_name} --metadata metadata.json', shell=True)
+    with metrics.stage('publish'):
+        subprocess.call(f'datasette publish heroku {database_path} \
+            --name {app_name} --metadata metadata.json', shell=True)
+
+    if metrics_file is not None:
+        metrics.to_json(metrics_file)
+        metrics.to_prometheus_file(os.path.splitext(metrics_file)[0] + '.prom')
+        print(f"METRICS: {metrics_file}")
 
    
 if __name__ == "__main__":
@@ -124,4 +623,4 @@ if __name__ == "__main__":
     except IndexError:
         raise Exception('No Command line arg passed for app name.')
    
-    new_db(fields, app_name)
\ No newline at end of file
+    new_db(fields, app_name, incremental='--incremental' in sys.argv[2:])
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Compact record type for harvested IR items.
+
+Records are tuples holding only field values. Field names live once
+on a class shared by every record with the same fields, so a record
+costs a small fraction of the memory of a dict keyed on long field
+names like 'mods.sm_digital_object_identifier'.
+"""
+
+# characters removed from exported values
+clean_table = str.maketrans('', '', '\n\r')
+
+_record_types = {}
+
+
+class Record(tuple):
+    """
+    Tuple backed record with read-only dict style access.
+
+    Supports record[field], get, keys, values and items, which is
+    enough for csv.DictWriter and code written against dict records.
+    Iterating a record yields values, as with a tuple.
+
+    Records aren't dicts: pd.DataFrame and json.dumps see tuples, so
+    they get integer column labels and lists. Use as_dict for those,
+    or pd.DataFrame(records, columns=record.fields).
+    """
+
+    __slots__ = ()
+
+    fields = ()
+    # field: position, not index so tuple.index still works
+    _index = {}
+    field_keys = {}.keys()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        if i is None:
+            return default
+        return tuple.__getitem__(self, i)
+
+    def keys(self):
+        return self.field_keys
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return zip(self.fields, self)
+
+    def as_dict(self):
+        return dict(zip(self.fields, self))
+
+    def __repr__(self):
+        return f'Record({self.as_dict()!r})'
+
+
+def record_type(fields):
+    """
+    Record subclass for a field schema. Types are cached, so all
+    records with the same fields share one class.
+
+    Parameters:
+        fields: list of field names
+
+    Returns:
+        Record subclass. Instantiate with a sequence of values
+        in field order.
+    """
+    fields = tuple(fields)
+    cls = _record_types.get(fields)
+    if cls is None:
+        cls = type('Record', (Record,), {
+            '__slots__': (),
+            'fields': fields,
+            '_index': {field: i for i, field in enumerate(fields)},
+            'field_keys': dict.fromkeys(fields).keys()
+            })
+        _record_types[fields] = cls
+    return cls
@@ -0,0 +1,181 @@
+import os, time, sqlite3, hashlib, json, threading
+import requests
+from requests.structures import CaseInsensitiveDict
+
+"""
+Disk-backed HTTP response cache used by http_session.Session.
+
+Entries are keyed on url plus query params, expire after a TTL,
+are evicted least recently used first once the cache grows past
+max_size bytes and are revalidated with ETag/Last-Modified when
+the server provides them.
+"""
+
+
+class ResponseCache():
+    """SQLite backed cache of successful GET responses."""
+
+    db_name = 'responses.db'
+
+    def __init__(self, cache_dir='.noaa_cache', ttl=86400,
+        max_size=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+
+        if os.path.exists(cache_dir) == False:
+            os.makedirs(cache_dir)
+
+        # connection shared across threads, guarded by lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, self.db_name),
+            check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                headers TEXT,
+                stored_at REAL,
+                accessed_at REAL,
+                size INTEGER,
+                body BLOB
+            )""")
+        self.conn.commit()
+
+
+    @staticmethod
+    def key(url, params=None):
+        """
+        Cache key for url and query params.
+
+        Params are sorted so dict ordering doesn't matter.
+
+        Returns:
+            sha256 hex digest string.
+        """
+        items = sorted((params or {}).items())
+        return hashlib.sha256(
+            json.dumps([url, items]).encode('utf-8')).hexdigest()
+
+
+    def get(self, key):
+        """
+        Look up cache entry, updating its LRU access time.
+
+        Returns:
+            dict of entry info or None if not cached.
+        """
+        with self.lock:
+            row = self.conn.execute("""
+                SELECT url, etag, last_modified, headers, stored_at, body
+                FROM responses WHERE key = ?""", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key))
+            self.conn.commit()
+
+        url, etag, last_modified, headers, stored_at, body = row
+        return {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'headers': json.loads(headers),
+            'stored_at': stored_at,
+            'body': body
+            }
+
+
+    def is_fresh(self, entry):
+        """Check if entry is younger than ttl."""
+        return time.time() - entry['stored_at'] < self.ttl
+
+
+    def set(self, key, response):
+        """
+        Store successful response, then evict entries over max_size.
+
+        Parameters:
+            key: cache key
+            response: requests response object
+        """
+        body = response.content
+        now = time.time()
+        with self.lock:
+            self.conn.execute("""
+                INSERT OR REPLACE INTO responses VALUES
+                (?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+                key,
+                response.url,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                json.dumps({'Content-Type':
+                    response.headers.get('Content-Type', '')}),
+                now,
+                now,
+                len(body),
+                body))
+            self.evict()
+            self.conn.commit()
+
+
+    def refresh(self, key):
+        """Reset entry TTL after a 304 Not Modified revalidation."""
+        with self.lock:
+            now = time.time()
+            self.conn.execute("""
+                UPDATE responses SET stored_at = ?, accessed_at = ?
+                WHERE key = ?""", (now, now, key))
+            self.conn.commit()
+
+
+    def evict(self):
+        """
+        Delete least recently used entries until total size
+        is under max_size. Caller must hold lock.
+        """
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        rows = self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+
+    def clear(self):
+        """Remove all entries."""
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+
+
+    def close(self):
+        self.conn.close()
+
+
+def entry_to_response(entry):
+    """
+    Build requests response object from cache entry.
+
+    Parameters:
+        entry: dict returned by ResponseCache.get
+
+    Returns:
+        requests response object with status code 200.
+    """
+    r = requests.Response()
+    r.status_code = 200
+    r.url = entry['url']
+    r.headers = CaseInsensitiveDict(entry['headers'])
+    r.encoding = 'utf-8'
+    r._content = entry['body']
+    return r
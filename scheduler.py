@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+"""
+Collection level scheduler used by stats.py and publish_db.py.
+
+Runs one job per collection on a bounded thread pool and yields
+results as each collection completes, so the downstream step can
+start on the first result instead of waiting for all of them.
+Per-host request limits are applied by http_session.Session.
+"""
+
+
+def run_collections(fn, pids, max_workers=4):
+    """
+    Run fn for each collection pid concurrently.
+
+    Parameters:
+        fn: function called with a collection pid
+        pids: iterable of collection pids
+        max_workers: max number of collections in flight
+
+    Returns:
+        generator of (pid, result) tuples, in completion order.
+        An exception raised by fn is raised when its result
+        is reached.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fn, pid): pid for pid in pids}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -0,0 +1,205 @@
+import re, sqlite3
+from bisect import bisect_left
+
+"""
+Search indexes over harvested collection data.
+
+SearchIndex keeps a lowercase copy of each indexed field plus an
+inverted index of word tokens, so lookups only verify the records
+that can match instead of scanning all of them. FTSSearchIndex
+provides the same token search backed by SQLite FTS5.
+"""
+
+token_re = re.compile(r'\w+')
+
+
+class SearchIndex():
+    """Inverted token index with lowercase field cache."""
+
+    def __init__(self, records, fields=()):
+        self.records = records
+        # field: list of lowercase values, one per record
+        self.lower = {}
+        # field: dict of token: list of record ids
+        self.postings = {}
+        # field: sorted tokens, used for prefix lookups
+        self.vocab = {}
+
+        for field in fields:
+            self.add_field(field)
+
+
+    def add_field(self, field):
+        """
+        Index field. Fields are indexed on first use if not
+        passed in when the index is created.
+        """
+        try:
+            lower = [str(record[field]).lower() for record in self.records]
+        except KeyError:
+            raise Exception('field not present. Check your RepositoryQuery instance fields')
+
+        postings = {}
+        for i, value in enumerate(lower):
+            for token in set(token_re.findall(value)):
+                postings.setdefault(token, []).append(i)
+
+        self.lower[field] = lower
+        self.postings[field] = postings
+        self.vocab[field] = sorted(postings)
+
+
+    def prefix_tokens(self, field, prefix):
+        """Indexed tokens of field starting with prefix."""
+        vocab = self.vocab[field]
+        tokens = []
+        for i in range(bisect_left(vocab, prefix), len(vocab)):
+            if not vocab[i].startswith(prefix):
+                break
+            tokens.append(vocab[i])
+        return tokens
+
+
+    def ids(self, field, tokens):
+        """Union of record ids for tokens of field."""
+        postings = self.postings[field]
+        ids = set()
+        for token in tokens:
+            ids.update(postings.get(token, ()))
+        return ids
+
+
+    def candidates(self, field, tokens):
+        """
+        Record ids that can contain a substring with these word
+        tokens: the first token must end a value token, the last
+        must start one and any in between must match exactly.
+        """
+        vocab = self.vocab[field]
+
+        if len(tokens) == 1:
+            return self.ids(field, [t for t in vocab if tokens[0] in t])
+
+        groups = [
+            [t for t in vocab if t.endswith(tokens[0])],
+            self.prefix_tokens(field, tokens[-1])
+            ]
+        groups.extend([t] for t in tokens[1:-1])
+
+        ids = None
+        for group in sorted(groups, key=len):
+            group_ids = self.ids(field, group)
+            ids = group_ids if ids is None else ids & group_ids
+            if not ids:
+                break
+        return ids
+
+
+    def contains(self, field, value):
+        """
+        Records whose field contains value, case insensitive.
+        Same results as a linear substring scan.
+
+        Parameters:
+            field: field to search
+            value: search string
+
+        Returns:
+            list of records, in collection order.
+        """
+        if field not in self.lower:
+            self.add_field(field)
+
+        value = value.lower()
+        lower = self.lower[field]
+
+        tokens = token_re.findall(value)
+        if tokens:
+            ids = sorted(self.candidates(field, tokens))
+        else:
+            ids = range(len(lower))
+
+        return [self.records[i] for i in ids if value in lower[i]]
+
+
+    def search(self, query, fields, prefix=True):
+        """
+        Records matching every word token of query in any of fields.
+
+        Parameters:
+            query: search string
+            fields: fields to search
+            prefix: tokens also match indexed tokens starting with them
+
+        Returns:
+            list of records, in collection order.
+        """
+        for field in fields:
+            if field not in self.lower:
+                self.add_field(field)
+
+        ids = None
+        for token in token_re.findall(query.lower()):
+            token_ids = set()
+            for field in fields:
+                if prefix:
+                    token_ids |= self.ids(field,
+                        self.prefix_tokens(field, token))
+                else:
+                    token_ids |= self.ids(field, [token])
+            ids = token_ids if ids is None else ids & token_ids
+            if not ids:
+                break
+
+        return [self.records[i] for i in sorted(ids or ())]
+
+
+class FTSSearchIndex():
+    """Token search backed by an in-memory SQLite FTS5 table."""
+
+    def __init__(self, records, fields):
+        self.records = records
+        self.fields = list(fields)
+        # fts columns are c0, c1... since field names contain dots
+        self.columns = {f: f'c{i}' for i, f in enumerate(self.fields)}
+
+        self.conn = sqlite3.connect(':memory:')
+        columns = ', '.join(self.columns.values())
+        self.conn.execute(f'CREATE VIRTUAL TABLE records USING fts5({columns})')
+
+        placeholders = ', '.join('?' for f in self.fields)
+        try:
+            rows = ([i] + [str(record[f]) for f in self.fields]
+                for i, record in enumerate(records))
+            self.conn.executemany(f'INSERT INTO records (rowid, {columns}) '
+                f'VALUES (?, {placeholders})', rows)
+        except KeyError:
+            raise Exception('field not present. Check your RepositoryQuery instance fields')
+        self.conn.commit()
+
+
+    def search(self, query, fields=None, prefix=True):
+        """
+        Records matching every word token of query in any of fields.
+
+        Parameters:
+            query: search string
+            fields: fields to search. All indexed fields if None.
+            prefix: tokens also match indexed tokens starting with them
+
+        Returns:
+            list of records, in collection order.
+        """
+        tokens = token_re.findall(query.lower())
+        if not tokens:
+            return []
+
+        star = '*' if prefix else ''
+        match = ' AND '.join(f'"{t}"{star}' for t in tokens)
+        if fields is not None:
+            columns = ' '.join(self.columns[f] for f in fields)
+            match = f'{{{columns}}} : ({match})'
+
+        ids = self.conn.execute('SELECT rowid FROM records '
+            'WHERE records MATCH ? ORDER BY rowid', (match,))
+        return [self.records[i] for (i,) in ids]
@@ -0,0 +1,296 @@
+import os, json, mmap, struct, shutil, tempfile
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from records import record_type, clean_table
+
+"""
+Memory-mapped snapshot store for harvested IR data.
+
+A snapshot is a single binary file holding, for each field, the
+UTF-8 bytes of every value, byte offsets of each value and value
+offsets of each record (so multivalued fields keep their values),
+plus a PID index sorted by PID. Opening a snapshot only reads its
+header; columns are read from the memory map as they are used.
+
+File layout:
+    magic (8 bytes) | header length (uint64) | header JSON | sections
+
+Sections are 8 byte aligned so offset arrays can be cast to uint64
+memoryviews without copying.
+"""
+
+magic = b'NOAASNP1'
+
+
+def write_snapshot(file_path, docs, fields, key='PID'):
+    """
+    Write IR documents to a snapshot file.
+
+    Sections are spooled to temporary files next to file_path as
+    documents arrive and copied into the snapshot at the end, so
+    only key values, needed to sort the index, are held in memory.
+
+    Parameters:
+        file_path: snapshot file path
+        docs: iterable of documents, i.e.
+            RepositoryQuery.iter_collection_json
+        fields: fields to store
+        key: field the lookup index is built on
+
+    Returns:
+        number of records written.
+    """
+    tmp_dir = os.path.dirname(os.path.abspath(file_path))
+    data = {f: _Spool(tmp_dir) for f in fields}
+    value_offsets = {f: _Spool(tmp_dir, 'Q') for f in fields}
+    record_offsets = {f: _Spool(tmp_dir, 'Q') for f in fields}
+    keys = []
+    index = None
+
+    try:
+        # end offset of each field's data and value count so far
+        ends = {f: 0 for f in fields}
+        value_counts = {f: 0 for f in fields}
+        for field in fields:
+            value_offsets[field].append(0)
+            record_offsets[field].append(0)
+
+        count = 0
+        for doc in docs:
+            for field in fields:
+                value = doc.get(field)
+                if value is None:
+                    values = []
+                elif isinstance(value, list):
+                    values = value
+                else:
+                    values = [value]
+
+                for v in values:
+                    encoded = str(v).encode('utf-8')
+                    data[field].write(encoded)
+                    ends[field] += len(encoded)
+                    value_offsets[field].append(ends[field])
+                value_counts[field] += len(values)
+                record_offsets[field].append(value_counts[field])
+
+            if key in fields:
+                keys.append(doc.get(key) or '')
+            count += 1
+
+        sections = []
+        for i, field in enumerate(fields):
+            sections.append((f'{i}.data', data[field]))
+            sections.append((f'{i}.values', value_offsets[field]))
+            sections.append((f'{i}.records', record_offsets[field]))
+
+        if key in fields:
+            index = _Spool(tmp_dir, 'Q')
+            index.buffer = array('Q', sorted(range(count),
+                key=keys.__getitem__))
+            del keys[:]
+            sections.append(('key.index', index))
+
+        for name, spool in sections:
+            spool.flush()
+
+        # section offsets are relative to the end of the header
+        layout, position = {}, 0
+        for name, spool in sections:
+            layout[name] = [position, spool.length]
+            position += spool.length + (-spool.length % 8)
+
+        header = json.dumps({'fields': list(fields), 'count': count,
+            'key': key if key in fields else None,
+            'sections': layout}).encode('utf-8')
+        header += b' ' * (-(len(header) + 16) % 8)
+
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as fh:
+            fh.write(magic)
+            fh.write(struct.pack('<Q', len(header)))
+            fh.write(header)
+            for name, spool in sections:
+                spool.copy_to(fh)
+                fh.write(b'\0' * (-spool.length % 8))
+        os.replace(tmp_path, file_path)
+    finally:
+        for spools in (data, value_offsets, record_offsets):
+            for spool in spools.values():
+                spool.close()
+        if index is not None:
+            index.close()
+
+    return count
+
+
+class _Spool():
+    """
+    Section body buffered in memory and written to an unnamed
+    temporary file a chunk at a time.
+    """
+
+    def __init__(self, tmp_dir, typecode=None, chunk_size=1 << 20):
+        self.fh = tempfile.TemporaryFile(dir=tmp_dir)
+        self.buffer = bytearray() if typecode is None else array(typecode)
+        self.chunk_size = chunk_size
+        # bytes written to fh
+        self.length = 0
+
+
+    def write(self, data):
+        """Append bytes, for data sections."""
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+
+    def append(self, value):
+        """Append an item, for offset sections."""
+        self.buffer.append(value)
+        if len(self.buffer) * self.buffer.itemsize >= self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        self.fh.write(self.buffer)
+        self.length += len(self.buffer) * getattr(self.buffer, 'itemsize', 1)
+        del self.buffer[:]
+
+
+    def copy_to(self, fh):
+        """Copy spooled body to fh."""
+        self.flush()
+        self.fh.seek(0)
+        shutil.copyfileobj(self.fh, fh)
+
+
+    def close(self):
+        self.fh.close()
+
+
+class Snapshot(Sequence):
+    """
+    Read-only, memory-mapped view of a snapshot file.
+
+    Indexing or iterating yields compact Records shaped like
+    RepositoryQuery.filter_on_fields output, so a Snapshot can be
+    used as collection_data.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.fh = open(file_path, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mm[:8] != magic:
+            raise ValueError(f'{file_path} is not a snapshot file')
+        header_len = struct.unpack('<Q', self.mm[8:16])[0]
+        header = json.loads(self.mm[16:16 + header_len])
+
+        self.fields = header['fields']
+        self.count = header['count']
+        self.key = header['key']
+        self.base = 16 + header_len
+        self.layout = header['sections']
+        self.view = memoryview(self.mm)
+        self.columns = {}
+        self.record = record_type(self.fields)
+
+
+    def section(self, name):
+        start, length = self.layout[name]
+        start += self.base
+        return self.view[start:start + length]
+
+
+    def column(self, field):
+        """
+        Memory views of field's data, value and record offsets.
+        Created on first use.
+        """
+        if field not in self.columns:
+            i = self.fields.index(field)
+            self.columns[field] = (
+                self.section(f'{i}.data'),
+                self.section(f'{i}.values').cast('Q'),
+                self.section(f'{i}.records').cast('Q'))
+        return self.columns[field]
+
+
+    def values(self, field, i):
+        """
+        Values of field for record i.
+
+        Returns:
+            list of strings, empty if record has no value.
+        """
+        data, value_offsets, record_offsets = self.column(field)
+        start, end = record_offsets[i], record_offsets[i + 1]
+        return [str(data[value_offsets[j]:value_offsets[j + 1]], 'utf-8')
+            for j in range(start, end)]
+
+
+    def joined(self, field, delimiter='~'):
+        """
+        Generator of field values per record, multiple values
+        joined with delimiter, newlines removed.
+        """
+        for i in range(self.count):
+            yield delimiter.join(self.values(field, i)).translate(clean_table)
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('snapshot index out of range')
+        return self.record('~'.join(self.values(f, i)).translate(clean_table)
+            for f in self.fields)
+
+
+    def lookup(self, value):
+        """
+        Find record by key field, i.e. PID, using the sorted index.
+
+        Returns:
+            Record, None if not found.
+        """
+        if self.key is None:
+            raise ValueError('snapshot has no key index')
+
+        index = self.section('key.index').cast('Q')
+        keys = _KeyView(self, index)
+        i = bisect_left(keys, value)
+        if i < len(keys) and keys[i] == value:
+            return self[index[i]]
+        return None
+
+
+    def close(self):
+        self.columns = {}
+        self.view.release()
+        self.mm.close()
+        self.fh.close()
+
+
+class _KeyView(Sequence):
+    """Key values in sorted order, read lazily for bisect."""
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        values = self.snapshot.values(self.snapshot.key, self.index[i])
+        return values[0] if values else ''
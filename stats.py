@@ -1,7 +1,12 @@
-import sys, csv, os
+import csv, os, time
 from datetime import datetime
-import requests
+import numpy as np
 import pandas as pd
+from http_session import get_session
+from json_decode import decode_docs
+from scheduler import run_collections
+from snapshot import Snapshot
+from metrics import get_metrics
 
 pd.options.display.max_rows = 10 
 
@@ -15,9 +20,20 @@ class StatsData():
     baseurl = 'https://repository.library.noaa.gov/fedora/export/download/collection/'
 
     #instance variables
-    def __init__(self, *resource, pid_info=None):
+    def __init__(self, *resource, pid_info=None, session=None, max_workers=4,
+        metrics=None):
         # pid info
         self.pid_info = pid_info
+        # pooled session shared across all requests
+        self.session = session or get_session()
+        # request only PID and resource columns via fl param. Off
+        # by default, get_df then returns every column of the response
+        self.field_projection = False
+        # max number of collections fetched at once
+        self.max_workers = max_workers
+        # metrics.Metrics stage timings are recorded in. Shared
+        # Metrics, disabled unless configured, used if None
+        self.metrics = metrics or get_metrics()
 
         if len(resource) == 1:
             self.resource = resource[0]
@@ -37,14 +53,53 @@ class StatsData():
         """
 
         url = self.baseurl + get_pid(pid, self.pid_info)
-        r = check_url_status(url) # check url status
-    
-        df = get_dataframe_from_response(r, self.resource)
+
+        params = None
+        if self.field_projection:
+            resource = [self.resource] if isinstance(self.resource, str) \
+                else self.resource
+            params = {'fl': ','.join(['PID'] + resource)}
+
+        # check url status
+        r = check_url_status(url, self.session, params, self.metrics)
+
+        with self.metrics.stage('dataframe'):
+            df = get_dataframe_from_response(r, self.resource)
+        self.metrics.add('records', len(df))
 
         df['PID'] = df['PID'].str.replace('noaa:', '')
 
         return df
 
+    def get_df_from_snapshot(self, snapshot):
+        """
+        Gets collection data from a snapshot instead of the API.
+        Only PID and resource columns are read from the snapshot.
+
+        Parameters:
+            snapshot: snapshot file path or open Snapshot
+
+        Returns:
+            pandas DataFrame of collection data
+        """
+
+        if isinstance(snapshot, str):
+            snapshot = Snapshot(snapshot)
+
+        resource = [self.resource] if isinstance(self.resource, str) \
+            else self.resource
+
+        df = pd.DataFrame({column: list(snapshot.joined(column, ','))
+            for column in ['PID'] + resource})
+
+        for column in resource:
+            df = convert_df_list_to_str(df, column)
+
+        df['PID'] = df['PID'].str.replace('noaa:', '')
+
+        return df
+
+
     def facet_count_single(self,df):
         """
         Provides facet count for individual collections.
@@ -57,9 +112,7 @@ class StatsData():
             # ensures values are converted from strings from list
             df = convert_df_list_to_str(df, 'mods.sm_localcorpname').copy()
 
-            split_df = split_facets(df, 'mods.sm_localcorpname')
-    
-            facet_count = pd.melt(split_df)['value'].value_counts()
+            facet_count = count_facets(df, 'mods.sm_localcorpname')
 
         except TypeError:
             print('You must pass a DataFrame as an argumet')
@@ -81,14 +134,13 @@ class StatsData():
             # ensures values are converted from strings from list
             df = convert_df_list_to_str(df, 'mods.sm_localcorpname').copy()
 
-            split_df = split_facets(df, 'mods.sm_localcorpname')
-    
-            # joins split and df on index
-            join_df = split_df.join(df['PID'])
-
-            melt_df = me = pd.melt(join_df, id_vars='PID')
+            facets = explode_facets(df, 'mods.sm_localcorpname')
 
-            melt_df = melt_df.drop(columns=['variable'])
+            # carry PID over to each facet row
+            melt_df = pd.DataFrame({
+                'PID': df['PID'].to_numpy()[facets.index],
+                'value': facets.to_numpy()
+                })
 
 
         except TypeError:
@@ -102,23 +154,63 @@ class StatsData():
         """
         Provides facet counts for all collections.
 
-        """
+        Collections are fetched concurrently and each is counted
+        as soon as it arrives; counts are then summed.
 
-        df_list = []
+        """
 
-        for pid in self.pid_info.values():
-            df = self.get_df(pid)
-            df_list.append(df)
+        facet_count = None
 
-        concated_dfs = pd.concat(df_list, sort=False)
+        collections = run_collections(self.get_df,
+            self.pid_info.values(), self.max_workers)
+        for done, (pid, df) in enumerate(collections, 1):
+            with self.metrics.stage('count_facets'):
+                counts = count_facets(df, 'mods.sm_localcorpname')
 
-        split_df = split_facets(concated_dfs, 'mods.sm_localcorpname')
+                if facet_count is None:
+                    facet_count = counts
+                else:
+                    facet_count = facet_count.add(counts, fill_value=0)
+            self.metrics.progress('collections', done, len(self.pid_info))
 
-        facet_count = pd.melt(split_df)['value'].value_counts()
+        facet_count = facet_count.astype(int).sort_values(ascending=False)
 
         return facet_count
 
 
+    def facet_count_by_collection(self, *resource):
+        """
+        Facet counts broken down by collection, for one or more
+        facet fields, from a single pass over all collections.
+
+        Parameters:
+            resource: facet columns. Defaults to instance resource.
+
+        Returns:
+            dict of column: DataFrame of counts, one row per facet
+            value and one column per collection pid.
+        """
+
+        resource = list(resource) or ([self.resource]
+            if isinstance(self.resource, str) else self.resource)
+
+        df_list = []
+        collections = run_collections(self.get_df,
+            self.pid_info.values(), self.max_workers)
+        for done, (pid, df) in enumerate(collections, 1):
+            df = df[resource].copy()
+            df['collection'] = pid
+            df_list.append(df)
+            self.metrics.progress('collections', done, len(self.pid_info))
+
+        with self.metrics.stage('concat'):
+            df = pd.concat(df_list, ignore_index=True, sort=False)
+
+        with self.metrics.stage('count_facets'):
+            return {column: count_facets(df, column, by='collection')
+                for column in resource}
+
+
 # functions used in Class methods
 def normalize_doc_types(x):
     """
@@ -138,18 +230,27 @@ def check_if_list(x):
     return isinstance(x, list)
 
 
-def check_url_status(url):
+def check_url_status(url, session=None, params=None, metrics=None):
     """
-    Function to check url status. Exit script if status code not 200.
+    Function to check url status. Exception raised if status code
+    not 200 once the session's retries are used up.
     Parameter:
         url: queried by requests.
+        session: http_session Session. Shared session used if None.
+        params: query params
+        metrics: metrics.Metrics latency and bytes are recorded in.
+            Shared Metrics used if None.
     """
 
-    r = requests.get(url)
+    session = session or get_session()
+    metrics = metrics or get_metrics()
+
+    begin = time.perf_counter()
+    r = session.get(url, params=params)
+    metrics.request(time.perf_counter() - begin, len(r.content))
     if r.status_code != 200:
-        sys.exit(1)
-    elif r.status_code == 200:
-        return r
+        raise Exception(f'{url} returned status code {r.status_code}')
+    return r
 
 
 def get_dataframe_from_response(response, resource):
@@ -161,8 +262,7 @@ def get_dataframe_from_response(response, resource):
         resource: pandas daframe column name
     """
 
-    data = response.json()
-    docs = data['response']['docs']
+    docs = decode_docs(response.content)
 
     df = pd.DataFrame(docs)
 
@@ -185,33 +285,93 @@ def convert_df_list_to_str(df, resource):
         resource: dataframe column name.
     """
 
-    # convert lists to strings using string join accessor
-    if any(df[resource].apply(check_if_list)) == True:
-        df[resource] = df[resource].str.join(',')
+    is_list = df[resource].map(check_if_list)
 
-    
     if resource == 'mods.type_of_resource': 
 
-        # new rows are created if there are more than document type
-        # associated with a record
-        if any(df[resource].str.contains(',')) == True:
-            multi_docs = df[df[resource].str.contains(',')].copy()
+        # new rows are created for each document type associated
+        # with a record, any number of types. Lists are exploded
+        # directly rather than joined and split again
+        if is_list.any():
+            df = df.explode(resource, ignore_index=True)
+
+        has_comma = df[resource].str.contains(',', na=False)
+        if has_comma.any():
+            df[resource] = df[resource].where(~has_comma,
+                df.loc[has_comma, resource].str.split(','))
+            df = df.explode(resource, ignore_index=True)
+
+        # function is only applicable for doc types. Applied once
+        # per distinct doc type, then mapped back by category code
+        doc_types = pd.Categorical(df[resource])
+        normalized = np.asarray(
+            doc_types.categories.map(normalize_doc_types), dtype=object)
+        values = normalized[doc_types.codes]
+        values[doc_types.codes == -1] = np.nan
+        df[resource] = values
+
+    # convert lists to strings using string join accessor,
+    # only list values are joined, plain strings are left as is
+    elif is_list.any():
+        df[resource] = df[resource].where(~is_list,
+            df.loc[is_list, resource].str.join(','))
+
+    return df
+
 
-            multi_docs[resource] = multi_docs[resource].str.split(',')
-            one, two = multi_docs.copy(), multi_docs.copy()
+def explode_facets(df, resource):
+    """
+    Long form of facets, one row per facet value. Uses same
+    delimiters as split_facets without a wide frame.
+    Parameters:
+        df: pandas dataframe
+        resource: IR 'mods.sm_localcorpname' column
 
-            one[resource] =  one[resource].str[0]
-            two[resource] =  two[resource].str[1]
+    Returns:
+        Series of facet values, index is row position in df.
+    """
 
-            # delete multidocs
-            df.drop(index=multi_docs.index, axis=1, inplace=True)
+    values = df[resource].reset_index(drop=True).astype('object')
+    values = values.str.replace(", ", " ").str.replace(",", "; ")
 
-            df = df.append([one, two], ignore_index=True).copy()
+    facets = values.str.split('; ').explode()
+    return facets[facets.notnull()]
 
-        # function is only applicable for doc types
-        df[resource] = df[resource].apply(normalize_doc_types)
 
-    return df
+def count_facets(df, resource, by=None):
+    """
+    Count facet values by integer codes.
+
+    Facets are exploded once, coded as categoricals and counted
+    with numpy bincount.
+    Parameters:
+        df: pandas dataframe
+        resource: facet column
+        by: optional column to break counts down by, i.e. collection
+
+    Returns:
+        Series of counts sorted descending, or DataFrame with one
+        column per by value if by is given.
+    """
+
+    facets = explode_facets(df, resource)
+    facet_codes = pd.Categorical(facets.to_numpy())
+    categories = pd.Index(facet_codes.categories, name='value')
+    codes = facet_codes.codes
+
+    if by is None:
+        counts = np.bincount(codes, minlength=len(categories))
+        return pd.Series(counts, index=categories,
+            name='count').sort_values(ascending=False)
+
+    group_codes = pd.Categorical(df[by].to_numpy()[facets.index])
+    counts = np.bincount(group_codes.codes * len(categories) + codes,
+        minlength=len(categories) * len(group_codes.categories))
+    counts = counts.reshape(len(group_codes.categories), len(categories))
+
+    table = pd.DataFrame(counts.T, index=categories,
+        columns=pd.Index(group_codes.categories, name=by))
+    return table.loc[table.sum(axis=1).sort_values(ascending=False).index]
 
 
 def split_facets(df, resource):
@@ -0,0 +1,17 @@
+import os, sys
+import pytest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+# appended, so benchmark scripts don't shadow top level modules
+sys.path.append(os.path.join(root, 'benchmarks'))
+
+from solr_server import start_server
+
+
+@pytest.fixture(scope='session')
+def server():
+    """Stand-in export API with responses delayed at random."""
+    server = start_server(size=2000, latency=0.02)
+    yield server
+    server.shutdown()
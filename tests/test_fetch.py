@@ -0,0 +1,51 @@
+from api_query import (RepositoryQuery, concat_json, iter_json, iterate_rows,
+    get_row_total)
+
+
+def expected_pids(server, pid):
+    return [doc['PID'] for doc in server.collections[pid]]
+
+
+def test_concat_json_keeps_page_order(server):
+    total = get_row_total(server.view_url, 'noaa')
+    urls = iterate_rows(server.view_url, 'noaa', total, row_num=100)
+    assert len(urls) == 20
+
+    docs = concat_json(urls, server.view_url + 'noaa', max_workers=8)
+    assert [doc['PID'] for doc in docs] == expected_pids(server, 'noaa')
+
+
+def test_iter_json_keeps_page_order(server):
+    total = get_row_total(server.view_url, 'noaa')
+    urls = iterate_rows(server.view_url, 'noaa', total, row_num=150)
+
+    docs = iter_json(urls, server.view_url + 'noaa', max_workers=8)
+    assert [doc['PID'] for doc in docs] == expected_pids(server, 'noaa')
+
+
+def test_iterate_rows_start_skips_probe_page(server):
+    urls = iterate_rows(server.view_url, 'noaa', 2000, row_num=500, start=500)
+    docs = concat_json(urls, server.view_url + 'noaa', max_workers=4)
+    assert [doc['PID'] for doc in docs] == expected_pids(server, 'noaa')[500:]
+
+
+def test_collection_harvests_are_complete(server):
+    q = RepositoryQuery(['PID', 'mods.title'], max_workers=8)
+    q.api_url = server.view_url
+
+    q.get_single_collection_json('7')
+    assert [doc['PID'] for doc in q.collection_data] == \
+        expected_pids(server, '7')
+
+    docs = q.iter_collection_json('noaa')
+    assert [doc['PID'] for doc in docs] == expected_pids(server, 'noaa')
+
+
+def test_date_window(server):
+    q = RepositoryQuery(['PID', 'fgs.createdDate'], max_workers=4)
+    q.api_url = server.view_url
+    q.date_filter('2015-01-01', '2017-01-01')
+
+    dates = [doc['fgs.createdDate'] for doc in q.iter_collection_json('noaa')]
+    assert dates
+    assert all('2015-01-01' <= d < '2017-01-01' for d in dates)
@@ -0,0 +1,98 @@
+import sqlite3
+from api_query import RepositoryQuery
+from publish_db import (create_table, insert_records, create_indexes,
+    update_table, build_db, update_db)
+from solr_server import start_server
+
+fields = ['PID', 'mods.title', 'mods.type_of_resource']
+
+
+def harvest(server, pid='7'):
+    q = RepositoryQuery(fields)
+    q.api_url = server.view_url
+    return [r.as_dict() for r in q.iter_fields(q.iter_collection_json(pid))]
+
+
+def fts_pids(conn, table, query):
+    rows = conn.execute(f'SELECT t."PID" FROM "{table}_fts" f '
+        f'JOIN "{table}" t ON t.rowid = f.rowid '
+        f'WHERE "{table}_fts" MATCH ?', (query,))
+    return sorted(row[0] for row in rows)
+
+
+def loaded_table(records):
+    conn = sqlite3.connect(':memory:')
+    create_table(conn, 'col', fields)
+    insert_records(conn, 'col', fields, records)
+    create_indexes(conn, 'col', fields, ['mods.title'])
+    return conn
+
+
+def test_update_table_insert_update_delete(server):
+    records = harvest(server)
+    conn = loaded_table(records[:-1])
+
+    changed = dict(records[0], **{'mods.title': 'Revised zeppelin survey'})
+    deleted = records[1]
+    new = records[-1]
+    records = [changed] + records[2:]
+
+    counts = update_table(conn, 'col', fields, records)
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 1}
+
+    rows = conn.execute('SELECT * FROM col ORDER BY rowid').fetchall()
+    assert sorted(rows) == sorted(tuple(r[f] for f in fields)
+        for r in records)
+
+    # FTS stays in sync through the triggers
+    conn.execute("INSERT INTO col_fts (col_fts) VALUES ('integrity-check')")
+    assert fts_pids(conn, 'col', 'zeppelin') == [changed['PID']]
+    memo = fts_pids(conn, 'col', 'memorandum')
+    assert deleted['PID'] not in memo
+    assert new['PID'] in memo
+    assert len(memo) == len(records) - 1
+
+
+def test_update_table_unchanged_writes_nothing(server):
+    records = harvest(server)
+    conn = loaded_table(records)
+
+    counts = update_table(conn, 'col', fields, records)
+    assert counts == {'inserted': 0, 'updated': 0, 'deleted': 0}
+
+
+def test_update_db_matches_rebuild(tmp_path):
+    server = start_server(size=300)
+    try:
+        q = RepositoryQuery(fields)
+        q.api_url = server.view_url
+        database_path = str(tmp_path / 'collections.db')
+        build_db(database_path, q, fts_fields=['mods.title'])
+
+        # change one item and remove another from every collection
+        docs = server.collections['noaa']
+        changed, deleted = docs[0], docs[1]
+        changed['mods.title'] = 'Revised zeppelin survey'
+        for pid, collection in server.collections.items():
+            server.collections[pid] = [d for d in collection
+                if d is not deleted]
+        assert update_db(database_path, q, fts_fields=['mods.title'])
+
+        rebuilt_path = str(tmp_path / 'rebuilt.db')
+        build_db(rebuilt_path, q, fts_fields=['mods.title'])
+    finally:
+        server.shutdown()
+
+    conn = sqlite3.connect(database_path)
+    rebuilt = sqlite3.connect(rebuilt_path)
+    tables = [row[0] for row in rebuilt.execute("SELECT name FROM "
+        "sqlite_master WHERE type = 'table' AND sql NOT LIKE '%fts5%' "
+        "AND name NOT LIKE '%_fts_%'")]
+    assert 'all_unique_items' in tables
+    for table in tables:
+        query = f'SELECT * FROM "{table}" ORDER BY "PID"'
+        assert conn.execute(query).fetchall() == \
+            rebuilt.execute(query).fetchall()
+    assert fts_pids(conn, 'all_unique_items', 'zeppelin') == [changed['PID']]
+    assert conn.execute('SELECT 1 FROM all_unique_items WHERE "PID" = ?',
+        (deleted['PID'],)).fetchone() is None
@@ -0,0 +1,43 @@
+import random
+import pytest
+from api_query import RepositoryQuery
+from search_index import SearchIndex
+
+fields = ['PID', 'mods.title', 'mods.sm_localcorpname']
+
+
+@pytest.fixture(scope='module')
+def records(server):
+    q = RepositoryQuery(fields)
+    q.api_url = server.view_url
+    return list(q.iter_fields(q.iter_collection_json('noaa')))
+
+
+def linear_scan(records, field, value):
+    return [r for r in records if value.lower() in str(r[field]).lower()]
+
+
+@pytest.mark.parametrize('field', ['mods.title', 'mods.sm_localcorpname'])
+def test_contains_matches_linear_scan(records, field):
+    index = SearchIndex(records, [field])
+    rng = random.Random(0)
+
+    values = ['', ' ', '~', ',', 'memorandum', 'MEMORANDUM', 'orandum 1',
+        'um 12 on', 'on c', 'n', '12', 'coral', 'national weather',
+        'service~sea', 'states, national', 'zzz', 'noaa']
+    for _ in range(200):
+        value = str(rng.choice(records)[field])
+        start = rng.randrange(len(value))
+        values.append(value[start:start + rng.randint(1, 20)])
+
+    for value in values:
+        assert index.contains(field, value) == \
+            linear_scan(records, field, value), value
+
+
+def test_contains_indexes_field_on_first_use(records):
+    index = SearchIndex(records)
+    assert index.contains('PID', 'noaa:19') == \
+        linear_scan(records, 'PID', 'noaa:19')
+    with pytest.raises(Exception):
+        index.contains('mods.abstract', 'text')
@@ -0,0 +1,67 @@
+import pytest
+import snapshot
+from api_query import RepositoryQuery, field_values
+from snapshot import Snapshot, write_snapshot
+
+fields = ['PID', 'mods.title', 'mods.sm_localcorpname', 'mods.abstract']
+
+
+def harvest(server):
+    q = RepositoryQuery(fields)
+    q.api_url = server.view_url
+    return list(q.iter_collection_json('noaa'))
+
+
+@pytest.fixture(params=[1 << 20, 64], ids=['one_chunk', 'many_chunks'])
+def snapshot_file(request, server, tmp_path, monkeypatch):
+    # small chunks make every section spool to disk many times
+    monkeypatch.setattr(snapshot._Spool.__init__, '__defaults__',
+        (None, request.param))
+    docs = harvest(server)
+    path = str(tmp_path / 'noaa.snapshot')
+    assert write_snapshot(path, iter(docs), fields) == len(docs)
+    s = Snapshot(path)
+    yield s, docs
+    s.close()
+
+
+def test_round_trip(snapshot_file):
+    s, docs = snapshot_file
+    assert len(s) == len(docs)
+
+    for i, doc in enumerate(docs):
+        for field in fields:
+            value = doc.get(field)
+            expected = value if isinstance(value, list) else [value]
+            assert s.values(field, i) == expected
+        assert list(s[i]) == field_values(doc, fields)
+
+    assert list(s[-1]) == field_values(docs[-1], fields)
+    with pytest.raises(IndexError):
+        s[len(docs)]
+
+
+def test_lookup(snapshot_file):
+    s, docs = snapshot_file
+    for doc in docs[::7]:
+        assert list(s.lookup(doc['PID'])) == field_values(doc, fields)
+    assert s.lookup('noaa:missing') is None
+    assert s.lookup('') is None
+
+
+def test_missing_and_empty(tmp_path):
+    path = str(tmp_path / 'small.snapshot')
+    docs = [{'PID': 'noaa:2', 'mods.title': ['a\nb', 'ç']}, {'PID': 'noaa:1'}]
+    write_snapshot(path, docs, ['PID', 'mods.title'])
+    s = Snapshot(path)
+    assert s.values('mods.title', 0) == ['a\nb', 'ç']
+    assert s.values('mods.title', 1) == []
+    assert s[0]['mods.title'] == 'ab~ç'
+    assert s.lookup('noaa:1')['mods.title'] == ''
+    s.close()
+
+    write_snapshot(path, [], ['PID'])
+    s = Snapshot(path)
+    assert len(s) == 0
+    assert s.lookup('noaa:1') is None
+    s.close()